@@ -1,9 +1,15 @@
 from .binary import BinaryDiffException, BinaryDiff, ByteUtil
-from .filebytes import FileBytes
+from .asyncfilebytes import AsyncFileBytes
+from .filebytes import FileBytes, FileBytesStats
+from .search import MaskedSearch, MultiSearch
 
 __all__ = [
+    "AsyncFileBytes",
     "BinaryDiffException",
     "BinaryDiff",
     "ByteUtil",
     "FileBytes",
+    "FileBytesStats",
+    "MaskedSearch",
+    "MultiSearch",
 ]
@@ -0,0 +1,221 @@
+import asyncio
+from concurrent.futures import Executor
+from typing import Any, BinaryIO, Callable, List, Optional, TypeVar, Union, overload
+from typing_extensions import Final
+
+from .filebytes import FileBytes
+
+
+_T = TypeVar("_T")
+
+
+class AsyncFileBytes:
+
+    BATCH_SIZE: Final[int] = FileBytes.IO_SIZE * 8
+
+    def __init__(
+        self,
+        data: Union[BinaryIO, bytes, bytearray, memoryview, FileBytes],
+        *,
+        executor: Optional[Executor] = None,
+        use_mmap: bool = False,
+        cache_size: int = 0,
+    ) -> None:
+        # Wrap either an existing FileBytes or a new one for a handle or buffer, so that
+        # all of the overlay semantics are exactly the same. All file I/O is handed off to
+        # an executor so that it never blocks the event loop.
+        if isinstance(data, FileBytes):
+            self.__filebytes: FileBytes = data
+        else:
+            self.__filebytes = FileBytes(data, use_mmap=use_mmap, cache_size=cache_size)
+        self.__executor: Optional[Executor] = executor
+        self.__lock: Optional[asyncio.Lock] = None
+
+    @property
+    def filebytes(self) -> FileBytes:
+        return self.__filebytes
+
+    @property
+    def handle(self) -> BinaryIO:
+        return self.__filebytes.handle
+
+    def __len__(self) -> int:
+        return len(self.__filebytes)
+
+    def __get_lock(self) -> asyncio.Lock:
+        # Create the lock lazily, since on older versions of Python a lock is bound to
+        # whatever event loop is current when it is created.
+        if self.__lock is None:
+            self.__lock = asyncio.Lock()
+        return self.__lock
+
+    async def __run(self, func: Callable[..., _T], *args: Any) -> _T:
+        return await asyncio.get_running_loop().run_in_executor(self.__executor, func, *args)
+
+    async def __bytes(self, data: Union[bytes, FileBytes]) -> bytes:
+        # Load another FileBytes we were handed in one go, instead of once per batch.
+        if isinstance(data, FileBytes):
+            return await self.__run(data.__getitem__, slice(None))
+        return data
+
+    @overload
+    async def read(self, key: int) -> int:
+        ...
+
+    @overload
+    async def read(self, key: slice) -> bytes:
+        ...
+
+    async def read(self, key: Union[int, slice]) -> Union[int, bytes]:
+        # Equivalent to indexing into a FileBytes instance. Operations are serialized so
+        # that a read never sees a modification that is only partially made.
+        async with self.__get_lock():
+            if isinstance(key, int):
+                return await self.__run(self.__filebytes.__getitem__, key)
+
+            start, stop, step = key.indices(len(self.__filebytes))
+            if step != 1:
+                return await self.__run(self.__filebytes.__getitem__, key)
+            if stop <= start:
+                return b""
+
+            # Read in batches, giving the event loop a chance to run other tasks (and
+            # this one a chance to be cancelled) between each one.
+            data = bytearray(stop - start)
+            view = memoryview(data)
+            for offset in range(0, len(data), self.BATCH_SIZE):
+                await self.__run(self.__filebytes.readinto, start + offset, view[offset:(offset + self.BATCH_SIZE)])
+            view.release()
+            return bytes(data)
+
+    @overload
+    async def write(self, key: int, val: int) -> None:
+        ...
+
+    @overload
+    async def write(self, key: slice, val: bytes) -> None:
+        ...
+
+    async def write(self, key: Union[int, slice], val: Union[int, bytes]) -> None:
+        # Equivalent to assigning into a FileBytes instance. This only ever changes our
+        # in-memory overlay, but some strided writes need to read the file first.
+        async with self.__get_lock():
+            await self.__run(self.__filebytes.__setitem__, key, val)
+
+    async def append(self, data: Union[bytes, FileBytes, "AsyncFileBytes"]) -> None:
+        if isinstance(data, AsyncFileBytes):
+            data = await data.read(slice(None))
+        async with self.__get_lock():
+            await self.__run(self.__filebytes.append, data)
+
+    async def insert(self, offset: int, data: Union[bytes, FileBytes, "AsyncFileBytes"]) -> None:
+        if isinstance(data, AsyncFileBytes):
+            data = await data.read(slice(None))
+        async with self.__get_lock():
+            await self.__run(self.__filebytes.insert, offset, data)
+
+    async def delete(self, start: int, stop: Optional[int] = None) -> None:
+        async with self.__get_lock():
+            self.__filebytes.delete(start, stop)
+
+    async def pad(self, size: int, fill: int = 0) -> None:
+        async with self.__get_lock():
+            self.__filebytes.pad(size, fill)
+
+    async def truncate(self, size: int) -> None:
+        async with self.__get_lock():
+            self.__filebytes.truncate(size)
+
+    async def clone(self) -> "AsyncFileBytes":
+        async with self.__get_lock():
+            return AsyncFileBytes(self.__filebytes.clone(), executor=self.__executor)
+
+    async def search(
+        self,
+        search: Union[bytes, FileBytes],
+        *,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+    ) -> Optional[int]:
+        # Search in batches, each of which overlaps the next by enough to find a match
+        # that straddles the boundary between them.
+        async with self.__get_lock():
+            search = await self.__bytes(search)
+            searchlen = len(search)
+            searchstart = 0 if start is None else start
+            searchend = len(self.__filebytes) if end is None else min(end, len(self.__filebytes))
+            if searchstart < 0 or (searchend - searchlen) < searchstart:
+                # Never going to find it anyway.
+                return None
+
+            batch = max(searchlen, self.BATCH_SIZE)
+            for offset in range(searchstart, (searchend - searchlen) + 1, batch):
+                found = await self.__run(
+                    lambda: self.__filebytes.search(search, start=offset, end=min(offset + batch + searchlen - 1, searchend))
+                )
+                if found is not None:
+                    return found
+
+            # Could not find the data.
+            return None
+
+    async def search_all(
+        self,
+        search: Union[bytes, FileBytes],
+        *,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        overlapping: bool = False,
+        alignment: int = 1,
+    ) -> List[int]:
+        # Find every occurence of the search bytes, one batch at a time. Each batch only
+        # reports matches that start within it, and starts no earlier than just past the
+        # previous match so that non-overlapping results are the same as a single pass.
+        if alignment < 1:
+            raise ValueError("Alignment must be a positive integer!")
+
+        async with self.__get_lock():
+            search = await self.__bytes(search)
+            searchlen = len(search)
+            searchstart = 0 if start is None else start
+            searchend = len(self.__filebytes) if end is None else min(end, len(self.__filebytes))
+            if searchstart < 0 or (searchend - searchlen) < searchstart:
+                # Never going to find it anyway.
+                return []
+
+            results: List[int] = []
+            batch = max(searchlen, self.BATCH_SIZE)
+            nextmatch = searchstart
+            for offset in range(searchstart, (searchend - searchlen) + 1, batch):
+                batchstart = max(offset, nextmatch)
+                batchend = min(offset + batch + searchlen - 1, searchend)
+                if batchstart > (batchend - searchlen):
+                    continue
+
+                found = await self.__run(
+                    lambda: list(
+                        self.__filebytes.search_all(
+                            search,
+                            start=batchstart,
+                            end=batchend,
+                            overlapping=overlapping,
+                            alignment=alignment,
+                        )
+                    )
+                )
+                for match in found:
+                    if match >= offset + batch:
+                        break
+                    results.append(match)
+                    nextmatch = match + (1 if overlapping else max(searchlen, 1))
+            return results
+
+    async def write_changes(
+        self,
+        new_file: Optional[BinaryIO] = None,
+        *,
+        undo_log: Optional[str] = None,
+        fsync: bool = False,
+    ) -> None:
+        async with self.__get_lock():
+            await self.__run(lambda: self.__filebytes.write_changes(new_file, undo_log=undo_log, fsync=fsync))
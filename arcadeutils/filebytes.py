@@ -1,38 +1,1028 @@
-import shutil
-from typing import BinaryIO, Dict, List, Optional, Set, Tuple, Union, overload
+import hashlib
+import io
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import zlib
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar, Union, cast, overload
 from typing_extensions import Final
 
 
+_T = TypeVar("_T")
+
+# A saved copy of a range of a FileBytes instance, made up of the length of the range, the
+# pieces of the original file in it and the modified extents in it. All offsets are relative
+# to the start of the range.
+_Region = Tuple[int, List[Tuple[int, int, int]], List[Tuple[int, bytes]]]
+
+
+class _Overlay:
+    # A sorted list of non-overlapping, non-adjacent extents of modified bytes. Each
+    # extent is stored as a start offset and a bytearray of the replacement data, so
+    # that large modified regions cost one object instead of one entry per byte.
+    #
+    # Overlays can be layered on top of a frozen parent overlay which is shared between
+    # clones, so that each layer only holds its own changes. Any parent data at or past
+    # the cutoff has been truncated away by this layer and is hidden.
+
+    MAX_DEPTH: Final[int] = 8
+
+    def __init__(self, parent: Optional["_Overlay"] = None, stats: Optional["FileBytesStats"] = None) -> None:
+        self.stats: Optional[FileBytesStats] = stats
+        self.__starts: List[int] = []
+        self.__chunks: List[bytearray] = []
+        self.__parent: Optional[_Overlay] = parent
+        self.__cutoff: Optional[int] = None
+        self.__depth: int = (parent.__depth + 1) if parent is not None else 0
+
+    def __layers(self) -> Iterator[Tuple["_Overlay", Optional[int]]]:
+        # Walk from this layer down to the bottom-most parent, along with the offset
+        # past which each layer's data has been truncated away by a layer above it.
+        layer: Optional[_Overlay] = self
+        limit: Optional[int] = None
+        while layer is not None:
+            yield layer, limit
+            if layer.__cutoff is not None:
+                limit = layer.__cutoff if limit is None else min(limit, layer.__cutoff)
+            layer = layer.__parent
+
+    def __bool__(self) -> bool:
+        return any(
+            layer.__starts and (limit is None or layer.__starts[0] < limit)
+            for layer, limit in self.__layers()
+        )
+
+    def freeze(self) -> Optional["_Overlay"]:
+        # Return an overlay holding our current contents that is safe to share as the
+        # parent of new layers. The caller must stop writing to this layer afterwards.
+        if not self.__starts and self.__cutoff is None:
+            # No changes of our own, so our parent already represents us.
+            return self.__parent
+        if self.__depth >= self.MAX_DEPTH:
+            # Chains that are too deep make lookups slow, so squash them.
+            return self.flatten()
+        return self
+
+    def flatten(self) -> "_Overlay":
+        # Return a new single layer overlay with the same contents as this one.
+        if self.stats is not None:
+            self.stats.flattens += 1
+        flat = _Overlay(stats=self.stats)
+        for layer, limit in reversed(list(self.__layers())):
+            for start, chunk in zip(layer.__starts, layer.__chunks):
+                if limit is not None:
+                    if start >= limit:
+                        break
+                    chunk = chunk[:(limit - start)]
+                flat.write(start, chunk)
+        return flat
+
+    def clear(self) -> None:
+        self.__starts.clear()
+        self.__chunks.clear()
+        self.__parent = None
+        self.__cutoff = None
+        self.__depth = 0
+
+    def extents(self) -> Iterator[Tuple[int, bytearray]]:
+        if self.__parent is not None:
+            return self.flatten().extents()
+        return zip(self.__starts, self.__chunks)
+
+    def get(self, offset: int) -> Optional[int]:
+        for layer, limit in self.__layers():
+            if limit is not None and offset >= limit:
+                return None
+            index = bisect_right(layer.__starts, offset) - 1
+            if index >= 0:
+                rel = offset - layer.__starts[index]
+                chunk = layer.__chunks[index]
+                if rel < len(chunk):
+                    return chunk[rel]
+        return None
+
+    def intersects(self, start: int, stop: int) -> bool:
+        for layer, limit in self.__layers():
+            if limit is not None:
+                stop = min(stop, limit)
+            if stop <= start:
+                return False
+
+            # Find the last extent starting before the stop offset, and see if it reaches
+            # into the requested range.
+            index = bisect_left(layer.__starts, stop) - 1
+            if index >= 0 and (layer.__starts[index] + len(layer.__chunks[index])) > start:
+                return True
+        return False
+
+    def extract(self, start: int, stop: int) -> List[Tuple[int, bytes]]:
+        # Return a copy of all of the modifications between start and stop, relative to
+        # start. Only the layers' extents in that range are looked at.
+        flat = _Overlay()
+        for layer, limit in reversed(list(self.__layers())):
+            end = stop if limit is None else min(stop, limit)
+            index = max(bisect_right(layer.__starts, start) - 1, 0)
+            while index < len(layer.__starts) and layer.__starts[index] < end:
+                extstart = layer.__starts[index]
+                chunk = layer.__chunks[index]
+                lo = max(start, extstart)
+                hi = min(end, extstart + len(chunk))
+                if lo < hi:
+                    flat.write(lo - start, chunk[(lo - extstart):(hi - extstart)])
+                index += 1
+        return [(offset, bytes(chunk)) for offset, chunk in flat.extents()]
+
+    def apply(self, start: int, data: Union[bytearray, memoryview]) -> None:
+        # Lay any modifications overlapping data (which represents the bytes starting
+        # at start) over top of it, starting with the bottom-most parent so that newer
+        # layers win.
+        for layer, limit in reversed(list(self.__layers())):
+            if limit is not None and limit < (start + len(data)):
+                layer.__apply(start, memoryview(data)[:max(limit - start, 0)])
+            else:
+                layer.__apply(start, data)
+
+    def __apply(self, start: int, data: Union[bytearray, memoryview]) -> None:
+        stop = start + len(data)
+        index = max(bisect_right(self.__starts, start) - 1, 0)
+        while index < len(self.__starts):
+            extstart = self.__starts[index]
+            if extstart >= stop:
+                break
+            chunk = self.__chunks[index]
+            extend = extstart + len(chunk)
+            if extend > start:
+                lo = max(start, extstart)
+                hi = min(stop, extend)
+                data[(lo - start):(hi - start)] = memoryview(chunk)[(lo - extstart):(hi - extstart)]
+            index += 1
+
+    def write(self, offset: int, data: Union[bytes, bytearray]) -> None:
+        if not data:
+            return
+        end = offset + len(data)
+
+        # Find the range of extents that overlap or touch the new data, so that we can
+        # coalesce them all into a single extent.
+        first = bisect_right(self.__starts, offset) - 1
+        if first < 0 or (self.__starts[first] + len(self.__chunks[first])) < offset:
+            first += 1
+        last = bisect_right(self.__starts, end)
+
+        if first == last:
+            # Doesn't touch anything, this is a brand new extent.
+            self.__starts.insert(first, offset)
+            self.__chunks.insert(first, bytearray(data))
+            return
+
+        if self.__starts[first] <= offset:
+            # Grow the first extent in place, which makes sequential writes cheap.
+            merged = self.__chunks[first]
+            mergedstart = self.__starts[first]
+            rel = offset - mergedstart
+            merged[rel:(rel + len(data))] = data
+        else:
+            merged = bytearray(data)
+            mergedstart = offset
+
+        # Only the last touched extent can possibly reach past the new data.
+        laststart = self.__starts[last - 1]
+        lastchunk = self.__chunks[last - 1]
+        if (laststart + len(lastchunk)) > end and (last - 1 != first or mergedstart != laststart):
+            merged += lastchunk[(end - laststart):]
+
+        self.__starts[first:last] = [mergedstart]
+        self.__chunks[first:last] = [merged]
+
+    def scatter(self, offset: int, step: int, data: Union[bytes, bytearray]) -> None:
+        # Write each byte of data step bytes apart, starting at offset. The bytes in between
+        # are left alone, but any of the new bytes that touch existing extents, or each
+        # other, are coalesced with them in a single pass instead of one write per byte.
+        if not data:
+            return
+        if step == 1:
+            self.write(offset, data)
+            return
+        end = offset + (step * (len(data) - 1)) + 1
+
+        # Find the range of extents that overlap or touch the new data, same as a write.
+        first = bisect_right(self.__starts, offset) - 1
+        if first < 0 or (self.__starts[first] + len(self.__chunks[first])) < offset:
+            first += 1
+        last = bisect_right(self.__starts, end)
+        if first == last:
+            # Doesn't touch anything, so every byte is a brand new extent of its own.
+            self.__starts[first:first] = range(offset, end, step)
+            self.__chunks[first:first] = [bytearray((value,)) for value in data]
+            return
+
+        # Lay out those extents and the new bytes over the whole range they span, along
+        # with a mask of which bytes in that range are actually modified.
+        spanstart = min(offset, self.__starts[first])
+        spanend = max(end, self.__starts[last - 1] + len(self.__chunks[last - 1]))
+        span = bytearray(spanend - spanstart)
+        mask = bytearray(spanend - spanstart)
+        for extstart, chunk in zip(self.__starts[first:last], self.__chunks[first:last]):
+            rel = extstart - spanstart
+            span[rel:(rel + len(chunk))] = chunk
+            mask[rel:(rel + len(chunk))] = b"\1" * len(chunk)
+        span[(offset - spanstart):(end - spanstart):step] = data
+        mask[(offset - spanstart):(end - spanstart):step] = b"\1" * len(data)
+
+        # Now, every run of modified bytes becomes its own extent.
+        starts: List[int] = []
+        chunks: List[bytearray] = []
+        runstart = mask.find(1)
+        while runstart >= 0:
+            runend = mask.find(0, runstart)
+            if runend < 0:
+                runend = len(mask)
+            starts.append(spanstart + runstart)
+            chunks.append(span[runstart:runend])
+            runstart = mask.find(1, runend)
+
+        self.__starts[first:last] = starts
+        self.__chunks[first:last] = chunks
+
+    def __own(self) -> None:
+        # Pull our parents' contents into this layer so that it can be rearranged. The
+        # parents are shared with other clones, so they can't be modified themselves.
+        if self.__parent is not None:
+            flat = self.flatten()
+            self.__starts = flat.__starts
+            self.__chunks = flat.__chunks
+            self.__parent = None
+            self.__cutoff = None
+            self.__depth = 0
+
+    def __split(self, offset: int) -> int:
+        # Make sure that no extent straddles offset, returning the index of the first
+        # extent at or past it.
+        index = bisect_left(self.__starts, offset)
+        if index > 0:
+            chunk = self.__chunks[index - 1]
+            rel = offset - self.__starts[index - 1]
+            if rel < len(chunk):
+                self.__starts.insert(index, offset)
+                self.__chunks.insert(index, chunk[rel:])
+                del chunk[rel:]
+        return index
+
+    def insert(self, offset: int, count: int) -> None:
+        # Move any modifications at or past offset up by count, leaving a gap.
+        self.__own()
+        for index in range(self.__split(offset), len(self.__starts)):
+            self.__starts[index] += count
+
+    def delete(self, start: int, stop: int) -> None:
+        # Drop any modifications between start and stop, moving anything past that down
+        # to close the gap.
+        self.__own()
+        first = self.__split(start)
+        last = self.__split(stop)
+        del self.__starts[first:last]
+        del self.__chunks[first:last]
+        for index in range(first, len(self.__starts)):
+            self.__starts[index] -= stop - start
+
+        # Extents on either side of the gap might now touch, so coalesce them.
+        if 0 < first < len(self.__starts) and (self.__starts[first - 1] + len(self.__chunks[first - 1])) == self.__starts[first]:
+            self.__chunks[first - 1] += self.__chunks[first]
+            del self.__starts[first]
+            del self.__chunks[first]
+
+    def truncate(self, size: int) -> None:
+        # Drop any modifications at or past size.
+        if self.__parent is not None and (self.__cutoff is None or self.__cutoff > size):
+            # We can't modify our parents, so instead hide anything in them past this point.
+            self.__cutoff = size
+
+        index = bisect_left(self.__starts, size)
+        del self.__starts[index:]
+        del self.__chunks[index:]
+        if index > 0:
+            chunk = self.__chunks[index - 1]
+            rel = size - self.__starts[index - 1]
+            if rel < len(chunk):
+                del chunk[rel:]
+
+
+class _PieceTable:
+    # A sorted list of non-overlapping pieces of the original file, each mapping a run
+    # of offsets in our representation onto the offsets in the file it came from. Any
+    # offset not covered by a piece reads as zero unless an overlay says otherwise. A
+    # file that has never had anything inserted or deleted is a single piece which maps
+    # onto itself, and inserting or deleting only ever costs one pass over the pieces.
+
+    def __init__(self, length: int) -> None:
+        self.__starts: List[int] = [0] if length > 0 else []
+        self.__offsets: List[int] = [0] if length > 0 else []
+        self.__lengths: List[int] = [length] if length > 0 else []
+
+    def copy(self) -> "_PieceTable":
+        copy = _PieceTable(0)
+        copy.__starts = list(self.__starts)
+        copy.__offsets = list(self.__offsets)
+        copy.__lengths = list(self.__lengths)
+        return copy
+
+    def identity(self) -> Optional[int]:
+        # If the file is still only mapped onto itself, return how much of it is visible.
+        if not self.__starts:
+            return 0
+        if len(self.__starts) == 1 and self.__starts[0] == 0 and self.__offsets[0] == 0:
+            return self.__lengths[0]
+        return None
+
+    def find(self, offset: int) -> Optional[int]:
+        # Return the file offset that a single offset maps onto, if any.
+        index = bisect_right(self.__starts, offset) - 1
+        if index >= 0 and (offset - self.__starts[index]) < self.__lengths[index]:
+            return self.__offsets[index] + (offset - self.__starts[index])
+        return None
+
+    def contiguous(self, start: int, stop: int) -> Optional[int]:
+        # Return the file offset that a range maps onto, if all of it is in one piece.
+        index = bisect_right(self.__starts, start) - 1
+        if index >= 0 and (stop - self.__starts[index]) <= self.__lengths[index]:
+            return self.__offsets[index] + (start - self.__starts[index])
+        return None
+
+    def ranges(self, start: int, stop: int) -> Iterator[Tuple[int, int, int]]:
+        # Yield the offset, file offset and length of every piece overlapping a range,
+        # clipped to that range.
+        index = max(bisect_right(self.__starts, start) - 1, 0)
+        while index < len(self.__starts):
+            piecestart = self.__starts[index]
+            if piecestart >= stop:
+                break
+            pieceend = piecestart + self.__lengths[index]
+            if pieceend > start:
+                lo = max(start, piecestart)
+                hi = min(stop, pieceend)
+                yield lo, self.__offsets[index] + (lo - piecestart), hi - lo
+            index += 1
+
+    def extract(self, start: int, stop: int) -> List[Tuple[int, int, int]]:
+        # Return a copy of all of the pieces between start and stop, relative to start.
+        return [(piecestart - start, fileoffset, length) for piecestart, fileoffset, length in self.ranges(start, stop)]
+
+    def paste(self, offset: int, pieces: List[Tuple[int, int, int]]) -> None:
+        # Fill in a gap left by insert with pieces that were previously extracted, joining
+        # them back up with their neighbours where possible.
+        index = bisect_left(self.__starts, offset)
+        for rel, fileoffset, length in pieces:
+            self.__starts.insert(index, offset + rel)
+            self.__offsets.insert(index, fileoffset)
+            self.__lengths.insert(index, length)
+            index += 1
+        for merge in range(index - 1, index - len(pieces) - 2, -1):
+            self.__merge(merge)
+
+    def __merge(self, index: int) -> None:
+        # Join a piece with the next one if they are next to each other in both our
+        # representation and the file.
+        if 0 <= index < (len(self.__starts) - 1):
+            end = self.__starts[index] + self.__lengths[index]
+            fileend = self.__offsets[index] + self.__lengths[index]
+            if end == self.__starts[index + 1] and fileend == self.__offsets[index + 1]:
+                self.__lengths[index] += self.__lengths[index + 1]
+                del self.__starts[index + 1]
+                del self.__offsets[index + 1]
+                del self.__lengths[index + 1]
+
+    def __split(self, offset: int) -> int:
+        # Make sure that no piece straddles offset, returning the index of the first
+        # piece at or past it.
+        index = bisect_left(self.__starts, offset)
+        if index > 0:
+            rel = offset - self.__starts[index - 1]
+            if rel < self.__lengths[index - 1]:
+                self.__starts.insert(index, offset)
+                self.__offsets.insert(index, self.__offsets[index - 1] + rel)
+                self.__lengths.insert(index, self.__lengths[index - 1] - rel)
+                self.__lengths[index - 1] = rel
+        return index
+
+    def insert(self, offset: int, count: int) -> None:
+        # Move any pieces at or past offset up by count, leaving a gap.
+        for index in range(self.__split(offset), len(self.__starts)):
+            self.__starts[index] += count
+
+    def delete(self, start: int, stop: int) -> None:
+        # Drop anything between start and stop, moving anything past that down to close
+        # the gap.
+        first = self.__split(start)
+        last = self.__split(stop)
+        del self.__starts[first:last]
+        del self.__offsets[first:last]
+        del self.__lengths[first:last]
+        for index in range(first, len(self.__starts)):
+            self.__starts[index] -= stop - start
+
+        # If this undid an earlier insert, the pieces on either side join back up.
+        self.__merge(first - 1)
+
+    def truncate(self, size: int) -> None:
+        # Drop anything at or past size.
+        index = bisect_left(self.__starts, size)
+        del self.__starts[index:]
+        del self.__offsets[index:]
+        del self.__lengths[index:]
+        if index > 0:
+            self.__lengths[index - 1] = min(self.__lengths[index - 1], size - self.__starts[index - 1])
+
+
+class _BufferHandle(io.RawIOBase):
+    # A file-like wrapper around an in-memory buffer, so that a FileBytes can be made
+    # directly from bytes, a bytearray or a memoryview. Reads never go through here since
+    # the buffer is sliced directly, but writing changes back does. Only a bytearray can
+    # change size, and bytes or a read-only memoryview can't be written to at all.
+
+    def __init__(self, buffer: Union[bytes, bytearray, memoryview]) -> None:
+        super().__init__()
+        self.buffer: Union[bytes, bytearray, memoryview] = buffer.cast("B") if isinstance(buffer, memoryview) else buffer
+        self.__position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def writable(self) -> bool:
+        return not isinstance(self.buffer, bytes) and not (isinstance(self.buffer, memoryview) and self.buffer.readonly)
+
+    def check(self, length: int) -> None:
+        # Make sure that changes of the given length can be written back before starting,
+        # so that we never leave a buffer partially written.
+        if not self.writable():
+            raise Exception("Cannot write changes back to a read-only buffer!")
+        if length != len(self.buffer) and not isinstance(self.buffer, bytearray):
+            raise Exception("Cannot change the size of a memoryview!")
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.__position
+        elif whence == io.SEEK_END:
+            offset += len(self.buffer)
+        if offset < 0:
+            raise ValueError("Negative seek position!")
+        self.__position = offset
+        return offset
+
+    def tell(self) -> int:
+        return self.__position
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        start = min(self.__position, len(self.buffer))
+        stop = len(self.buffer) if (size is None or size < 0) else min(start + size, len(self.buffer))
+        self.__position = stop
+        return bytes(self.buffer[start:stop])
+
+    def readinto(self, view: "memoryview") -> int:  # type: ignore
+        data = self.read(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    def write(self, data: bytes) -> int:  # type: ignore
+        buffer = self.buffer
+        if isinstance(buffer, bytes) or (isinstance(buffer, memoryview) and buffer.readonly):
+            raise io.UnsupportedOperation("Cannot write to a read-only buffer!")
+        end = self.__position + len(data)
+        if end > len(buffer):
+            if not isinstance(buffer, bytearray):
+                raise io.UnsupportedOperation("Cannot change the size of a memoryview!")
+            buffer.extend(bytes(end - len(buffer)))
+        buffer[self.__position:end] = data
+        self.__position = end
+        return len(data)
+
+    def truncate(self, size: Optional[int] = None) -> int:
+        size = self.__position if size is None else size
+        if size != len(self.buffer):
+            if not isinstance(self.buffer, bytearray):
+                raise io.UnsupportedOperation("Cannot change the size of this buffer!")
+            if size < len(self.buffer):
+                del self.buffer[size:]
+            else:
+                self.buffer.extend(bytes(size - len(self.buffer)))
+        return size
+
+
+class _FileSource:
+    # The underlying file that one or more FileBytes instances read from. This is
+    # shared between clones so that the same file is only ever mapped or cached once.
+    #
+    # Reads are safe to make from multiple threads at once. Real files are read with
+    # positional reads which never touch the handle's position, and anything else falls
+    # back to seeking and reading while holding the lock. The cache is also protected
+    # by the lock, since looking up a block reorders it. In-memory buffers are sliced
+    # directly, the same way a mapped file is. They are only ever viewed for the length of
+    # a single read, so that the owner of a bytearray is still free to resize it.
+
+    def __init__(
+        self,
+        handle: BinaryIO,
+        use_mmap: bool,
+        cache_size: int,
+        block_size: int,
+        stats: Optional["FileBytesStats"] = None,
+    ) -> None:
+        self.handle: BinaryIO = handle
+        self.stats: Optional[FileBytesStats] = stats
+        self.__use_mmap = use_mmap
+        self.__mmap: Optional[mmap.mmap] = None
+        self.__buffer: Optional[Union[bytes, bytearray, memoryview]] = handle.buffer if isinstance(handle, _BufferHandle) else None
+        self.__block_size = block_size
+        self.__cache_blocks = (max(cache_size // block_size, 1) if cache_size > 0 else 0)
+        self.__cache: "OrderedDict[int, bytes]" = OrderedDict()
+        self.__fd: Optional[int] = None
+        self.lock: threading.RLock = threading.RLock()
+
+        # Hashes of runs of the file, keyed by file offset and length, so that hashing the
+        # same untouched parts of the file again after a change doesn't need to read them.
+        self.crcs: "OrderedDict[Tuple[int, int], int]" = OrderedDict()
+        self.digests: "OrderedDict[Tuple[int, int], bytes]" = OrderedDict()
+        self.refresh()
+
+    @staticmethod
+    def fileno(handle: BinaryIO) -> Optional[int]:
+        # Return the descriptor of a handle only if reading it directly from the OS gives
+        # the same bytes as reading the handle itself. Wrappers such as gzip, bz2 and lzma
+        # files hand back the descriptor of the compressed file underneath, so only plain
+        # files qualify.
+        if not isinstance(getattr(handle, "raw", handle), io.FileIO):
+            return None
+        try:
+            return handle.fileno()
+        except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+            return None
+
+    def unmap(self) -> None:
+        # Drop the mapping, which must be done before the file is resized on some
+        # platforms.
+        if self.__mmap is not None:
+            self.__mmap.close()
+            self.__mmap = None
+
+    def refresh(self) -> None:
+        # Map (or re-map after a write) the file if requested and possible. Anything
+        # that isn't a real file on disk, such as a BytesIO or a pipe, along with empty
+        # files which cannot be mapped, will fall back to seeking and reading. Any cached
+        # blocks are also thrown away since the file may have changed underneath them.
+        self.unmap()
+        with self.lock:
+            self.__cache.clear()
+            self.crcs.clear()
+            self.digests.clear()
+        self.__fd = None
+        if self.__buffer is not None:
+            return
+        fd = _FileSource.fileno(self.handle)
+        if hasattr(os, "pread") and fd is not None:
+            try:
+                os.pread(fd, 0, 0)
+                self.__fd = fd
+            except OSError:
+                self.__fd = None
+        if not self.__use_mmap or fd is None:
+            return
+        try:
+            self.__mmap = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self.__mmap = None
+
+    def hashed(
+        self,
+        cache: "OrderedDict[Tuple[int, int], _T]",
+        fileoffset: int,
+        length: int,
+        limit: int,
+        compute: Callable[[], _T],
+    ) -> _T:
+        # Look up the hash of a run of the file, computing and remembering it if needed.
+        # Every insert or delete shifts later runs onto new keys, so only the most recently
+        # used hashes are kept in order to stop the cache growing without bound.
+        if self.__buffer is not None:
+            # The owner of a buffer can change it at any time without us knowing, so
+            # nothing about its contents can be remembered. Hashing memory is cheap anyway.
+            return compute()
+
+        key = (fileoffset, length)
+        with self.lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+                return value
+
+        value = compute()
+        with self.lock:
+            cache[key] = value
+            while len(cache) > limit:
+                cache.popitem(last=False)
+        return value
+
+    def __count(self, length: int, seeks: int = 0) -> None:
+        # Account for a single read of length bytes from the file.
+        if self.stats is not None:
+            self.stats.seeks += seeks
+            self.stats.reads += 1
+            self.stats.bytes_read += length
+
+    def __pread(self, offset: int, length: int) -> bytes:
+        # Read up to length bytes at offset without disturbing any other reader.
+        if self.__fd is None:
+            with self.lock:
+                self.handle.seek(offset)
+                data = self.handle.read(length)
+                self.__count(len(data), seeks=1)
+                return data
+
+        data = os.pread(self.__fd, length, offset)
+        self.__count(len(data))
+        if len(data) == length or not data:
+            return data
+
+        # Short read, keep going until we have everything or hit the end of the file.
+        chunks: List[bytes] = [data]
+        while length > len(data):
+            offset += len(data)
+            length -= len(data)
+            data = os.pread(self.__fd, length, offset)
+            self.__count(len(data))
+            if not data:
+                break
+            chunks.append(data)
+        return b"".join(chunks)
+
+    def __block(self, index: int) -> bytes:
+        # Look up a single block in the cache, loading it and evicting the least
+        # recently used block if it is not present.
+        with self.lock:
+            data = self.__cache.get(index)
+            if data is not None:
+                self.__cache.move_to_end(index)
+                if self.stats is not None:
+                    self.stats.cache_hits += 1
+                return data
+
+            data = self.__pread(index * self.__block_size, self.__block_size)
+            self.__cache[index] = data
+            if len(self.__cache) > self.__cache_blocks:
+                self.__cache.popitem(last=False)
+            return data
+
+    def read(self, offset: int, length: int) -> bytes:
+        if self.__buffer is not None:
+            with memoryview(self.__buffer) as buffer:
+                data = buffer[offset:(offset + length)].tobytes()
+            self.__count(len(data))
+            return data
+        if self.__mmap is not None:
+            data = self.__mmap[offset:(offset + length)]
+            self.__count(len(data))
+            return data
+        if length <= 0:
+            return b""
+
+        first = offset // self.__block_size
+        last = (offset + length - 1) // self.__block_size
+        if self.__cache_blocks == 0 or (last - first) >= self.__cache_blocks:
+            # Either we aren't caching, or this read would blow out the whole cache
+            # anyway, so just go straight to the file.
+            return self.__pread(offset, length)
+
+        rel = offset - (first * self.__block_size)
+        if first == last:
+            return self.__block(first)[rel:(rel + length)]
+
+        chunks: List[bytes] = []
+        for index in range(first, last + 1):
+            data = self.__block(index)
+            chunks.append(data)
+            if len(data) < self.__block_size:
+                # Hit the end of the file.
+                break
+        return b"".join(chunks)[rel:(rel + length)]
+
+    def readinto(self, offset: int, view: memoryview) -> int:
+        # Read directly into a caller's buffer, returning how many bytes were read.
+        length = len(view)
+        if self.__buffer is not None:
+            length = max(min(length, len(self.__buffer) - offset), 0)
+            with memoryview(self.__buffer) as buffer:
+                view[:length] = buffer[offset:(offset + length)]
+            self.__count(length)
+            return length
+        if self.__mmap is not None:
+            length = max(min(length, len(self.__mmap) - offset), 0)
+            with memoryview(self.__mmap) as mapped:
+                view[:length] = mapped[offset:(offset + length)]
+            self.__count(length)
+            return length
+        if self.__cache_blocks != 0 and length <= (self.__cache_blocks * self.__block_size):
+            data = self.read(offset, length)
+            view[:len(data)] = data
+            return len(data)
+
+        total = 0
+        if self.__fd is not None:
+            if not hasattr(os, "preadv"):
+                data = self.__pread(offset, length)
+                view[:len(data)] = data
+                return len(data)
+            while total < length:
+                amount = os.preadv(self.__fd, [view[total:]], offset + total)
+                self.__count(amount)
+                if not amount:
+                    break
+                total += amount
+            return total
+
+        with self.lock:
+            self.handle.seek(offset)
+            readinto = getattr(self.handle, "readinto", None)
+            if readinto is None:
+                data = self.handle.read(length)
+                self.__count(len(data), seeks=1)
+                view[:len(data)] = data
+                return len(data)
+
+            seeks = 1
+            while total < length:
+                amount = readinto(view[total:])
+                self.__count(amount or 0, seeks=seeks)
+                seeks = 0
+                if not amount:
+                    break
+                total += amount
+            return total
+
+    def byte(self, offset: int) -> int:
+        if self.__buffer is not None:
+            self.__count(1)
+            return self.__buffer[offset]
+        if self.__mmap is not None:
+            self.__count(1)
+            return self.__mmap[offset]
+        if self.__cache_blocks == 0:
+            return self.__pread(offset, 1)[0]
+        return self.__block(offset // self.__block_size)[offset % self.__block_size]
+
+
+class _CRC32:
+    # Combines the CRC32 of two runs of data into the CRC32 of both run together, the same
+    # way that zlib's crc32_combine does. Appending a run of a given length to some data
+    # is a linear operation on its CRC, represented as a 32x32 matrix over GF(2), so the
+    # matrix for each length is built once from the matrices for each power of two.
+
+    __powers: List[List[int]] = []
+    __shifts: Dict[int, List[int]] = {}
+
+    @staticmethod
+    def __times(matrix: List[int], vector: int) -> int:
+        total = 0
+        index = 0
+        while vector:
+            if vector & 1:
+                total ^= matrix[index]
+            vector >>= 1
+            index += 1
+        return total
+
+    @staticmethod
+    def __square(matrix: List[int]) -> List[int]:
+        return [_CRC32.__times(matrix, column) for column in matrix]
+
+    @staticmethod
+    def __shift(length: int) -> List[int]:
+        # Return the matrix which moves a CRC past length bytes of zeros.
+        shift = _CRC32.__shifts.get(length)
+        if shift is not None:
+            return shift
+
+        if not _CRC32.__powers:
+            # Start with the matrix for a single zero bit, and square it up to a byte.
+            matrix = [0xEDB88320] + [1 << bit for bit in range(31)]
+            for _ in range(3):
+                matrix = _CRC32.__square(matrix)
+            _CRC32.__powers.append(matrix)
+
+        shift = [1 << bit for bit in range(32)]
+        power = 0
+        remaining = length
+        while remaining:
+            while len(_CRC32.__powers) <= power:
+                _CRC32.__powers.append(_CRC32.__square(_CRC32.__powers[-1]))
+            if remaining & 1:
+                matrix = _CRC32.__powers[power]
+                shift = [_CRC32.__times(matrix, column) for column in shift]
+            remaining >>= 1
+            power += 1
+
+        if len(_CRC32.__shifts) < 64:
+            # Only a handful of distinct lengths ever get used, but don't grow forever.
+            _CRC32.__shifts[length] = shift
+        return shift
+
+    @staticmethod
+    def combine(first: int, second: int, length: int) -> int:
+        # Return the CRC32 of two runs, given the CRC of each and the second's length.
+        if length <= 0:
+            return first
+        return _CRC32.__times(_CRC32.__shift(length), first) ^ second
+
+
+class _UndoLog:
+    # A sidecar file holding everything an in-place write is about to overwrite, so that
+    # an interrupted write can be rolled back. The log starts with a header holding the
+    # original length of the file, followed by the offset, length and original data for
+    # each range, and ends with a footer holding the CRC32 of everything before it. A log
+    # without a valid footer was never finished, and so the file was never touched.
+
+    HEADER: Final[bytes] = b"FBUNDO01"
+    FOOTER: Final[bytes] = b"FBCOMMIT"
+
+    @staticmethod
+    def sync(handle: BinaryIO) -> None:
+        # Make sure a file's contents are on disk, for anything that is a real file.
+        try:
+            fd = handle.fileno()
+        except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+            return
+        os.fsync(fd)
+
+    @staticmethod
+    def sync_directory(path: str) -> None:
+        # Make sure a file's directory entry is on disk, where the platform allows.
+        try:
+            fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def write(path: str, source: _FileSource, length: int, ranges: List[Tuple[int, int]], fsync: bool, block_size: int) -> None:
+        with open(path, "wb") as log:
+            crc = 0
+            header = _UndoLog.HEADER + struct.pack("<Q", length)
+            log.write(header)
+            crc = zlib.crc32(header, crc)
+            for start, stop in ranges:
+                record = struct.pack("<QQ", start, stop - start)
+                log.write(record)
+                crc = zlib.crc32(record, crc)
+                for offset in range(start, stop, block_size):
+                    data = source.read(offset, min(block_size, stop - offset))
+                    if len(data) != min(block_size, stop - offset):
+                        raise Exception("Logic error, original file is shorter than expected!")
+                    log.write(data)
+                    crc = zlib.crc32(data, crc)
+            log.write(_UndoLog.FOOTER + struct.pack("<I", crc))
+            log.flush()
+            if fsync:
+                _UndoLog.sync(log)
+        if fsync:
+            _UndoLog.sync_directory(path)
+
+    @staticmethod
+    def records(log: BinaryIO, block_size: int) -> Iterator[Tuple[int, bytes]]:
+        # Yield the offset and data for each block of the original file saved in a log.
+        log.seek(len(_UndoLog.HEADER) + 8)
+        while True:
+            record = log.read(16)
+            if len(record) < 16 or record[:8] == _UndoLog.FOOTER:
+                return
+            start, length = struct.unpack("<QQ", record)
+            for offset in range(start, start + length, block_size):
+                data = log.read(min(block_size, start + length - offset))
+                yield offset, data
+
+    @staticmethod
+    def valid(log: BinaryIO, block_size: int) -> Optional[int]:
+        # Return the original length of the file if the log was completely written.
+        header = log.read(len(_UndoLog.HEADER) + 8)
+        if len(header) < len(_UndoLog.HEADER) + 8 or not header.startswith(_UndoLog.HEADER):
+            return None
+        crc = zlib.crc32(header)
+        while True:
+            record = log.read(16)
+            if record[:8] == _UndoLog.FOOTER:
+                if len(record) == 12 and struct.unpack("<I", record[8:])[0] == crc:
+                    length: int = struct.unpack("<Q", header[len(_UndoLog.HEADER):])[0]
+                    return length
+                return None
+            if len(record) < 16:
+                return None
+            crc = zlib.crc32(record, crc)
+            start, length = struct.unpack("<QQ", record)
+            while length > 0:
+                data = log.read(min(block_size, length))
+                if not data:
+                    return None
+                crc = zlib.crc32(data, crc)
+                length -= len(data)
+
+
+class FileBytesStats:
+    # Counters for everything a FileBytes instance does that might be slow, for working
+    # out why a particular job is. These are shared between an instance and its clones.
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.seeks: int = 0
+        self.reads: int = 0
+        self.bytes_read: int = 0
+        self.cache_hits: int = 0
+        self.overlay_hits: int = 0
+        self.flattens: int = 0
+        self.slow_slices: int = 0
+        self.bytes_written: int = 0
+
+    def dump(self) -> Dict[str, int]:
+        return {
+            "seeks": self.seeks,
+            "reads": self.reads,
+            "bytes_read": self.bytes_read,
+            "cache_hits": self.cache_hits,
+            "overlay_hits": self.overlay_hits,
+            "flattens": self.flattens,
+            "slow_slices": self.slow_slices,
+            "bytes_written": self.bytes_written,
+        }
+
+    def __repr__(self) -> str:
+        return "FileBytesStats(" + ", ".join(f"{name}={value}" for name, value in self.dump().items()) + ")"
+
+
 class FileBytes:
 
     IO_SIZE: Final[int] = 0x8000
-
-    def __init__(self, handle: BinaryIO) -> None:
+    HASH_SIZE: Final[int] = 0x8000
+
+    def __init__(
+        self,
+        handle: Union[BinaryIO, bytes, bytearray, memoryview],
+        *,
+        use_mmap: bool = False,
+        cache_size: int = 0,
+        journal: bool = False,
+        stats: bool = False,
+    ) -> None:
+        if isinstance(handle, (bytes, bytearray, memoryview)):
+            # Data that is already in memory is read directly instead of being wrapped
+            # in a BytesIO and read back out of it.
+            handle = cast(BinaryIO, _BufferHandle(handle))
         self.__handle: BinaryIO = handle
-        self.__patches: Dict[int, int] = {}
-        self.__regions: Set[int] = set()
+        self.__stats: Optional[FileBytesStats] = FileBytesStats() if stats else None
+        self.__source: _FileSource = _FileSource(handle, use_mmap, cache_size, self.IO_SIZE, self.__stats)
+        self.__patches: _Overlay = _Overlay(stats=self.__stats)
         self.__copies: List["FileBytes"] = []
         self.__unsafe: bool = False
-        self.__lowest_patch: Optional[int] = None
-        self.__highest_patch: Optional[int] = None
 
         handle.seek(0, 2)
-        self.__filelength: int = handle.tell()
-        self.__origfilelength: int = self.__filelength
-        self.__patchlength: int = self.__filelength
+        self.__origfilelength: int = handle.tell()
+        self.__patchlength: int = self.__origfilelength
+        self.__pieces: _PieceTable = _PieceTable(self.__origfilelength)
+
+        # Every edit made is optionally journaled as the range it replaced along with what
+        # it was replaced with, so that it can be undone and redone.
+        self.__journal: Optional[List[Tuple[int, _Region, _Region]]] = [] if journal else None
+        self.__journalpos: int = 0
+        self.__snapshots: Dict[str, int] = {}
 
     @property
     def handle(self) -> BinaryIO:
         return self.__handle
 
+    @property
+    def stats(self) -> Optional[FileBytesStats]:
+        return self.__stats
+
     def search(self, search: Union[bytes, "FileBytes"], *, start: Optional[int] = None, end: Optional[int] = None) -> Optional[int]:
         # Search the file for search bytes in a faster manner than reloading the
         # file byte for byte for every position to search.
+        for found in self.search_all(search, start=start, end=end):
+            return found
+
+        # Could not find the data.
+        return None
 
+    def rsearch(self, search: Union[bytes, "FileBytes"], *, start: Optional[int] = None, end: Optional[int] = None) -> Optional[int]:
+        # Search the file backwards for search bytes, returning the last occurence.
         searchlen = len(search)
-        if searchlen > self.__patchlength:
-            # There's no way that the search bytes could be in this file.
-            return None
         if isinstance(search, FileBytes):
             search = search[:]
 
@@ -40,73 +1030,241 @@ class FileBytes:
             searchstart = 0
         else:
             searchstart = start
-        if searchstart < 0 or searchstart > (self.__patchlength - (searchlen - 1)):
+        if end is None:
+            searchend = self.__patchlength
+        else:
+            searchend = min(end, self.__patchlength)
+        if searchstart < 0 or (searchend - searchlen) < searchstart:
             # Never going to find it anyway.
             return None
+        if searchlen == 0:
+            # Empty search bytes trivially match at the end.
+            return searchend
+
+        # Scan the file in large windows starting from the end, letting bytes.rfind do
+        # the comparing. Each window keeps the start of the previous window so that
+        # matches which straddle a window boundary are still found.
+        chunksize = max(searchlen, self.IO_SIZE) * 8
+        readoffset = searchend
+        data = b""
+
+        while readoffset > searchstart:
+            newstart = max(readoffset - chunksize, searchstart)
+            newdata = self[newstart:readoffset]
+            if not newdata:
+                break
+            data = (newdata + data[:(searchlen - 1)]) if searchlen > 1 else newdata
+            readoffset = newstart
+
+            found = data.rfind(search)
+            if found >= 0:
+                return readoffset + found
 
+        # Could not find the data.
+        return None
+
+    def search_all(
+        self,
+        search: Union[bytes, "FileBytes"],
+        *,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        overlapping: bool = False,
+        alignment: int = 1,
+    ) -> Iterator[int]:
+        # Find every occurence of the search bytes in a single pass over the file.
+        if alignment < 1:
+            raise ValueError("Alignment must be a positive integer!")
+
+        searchlen = len(search)
+        if isinstance(search, FileBytes):
+            search = search[:]
+
+        if start is None:
+            searchstart = 0
+        else:
+            searchstart = start
         if end is None:
             searchend = self.__patchlength
         else:
-            searchend = end
-        searchend -= (searchlen - 1)
-        if searchend <= searchstart:
+            searchend = min(end, self.__patchlength)
+        if searchstart < 0 or (searchend - searchlen) < searchstart:
             # Never going to find it anyway.
-            return None
-
-        chunksize = max(searchlen * 2, self.IO_SIZE)
-        startoffset = searchstart
-        data: bytes = self[searchstart:(searchstart + (chunksize * 3))]
-        endoffset = searchstart + len(data)
+            return
+        if searchlen == 0:
+            # Empty search bytes trivially match everywhere.
+            yield from range(searchstart + (-searchstart % alignment), searchend + 1, alignment)
+            return
 
-        def addchunk() -> bool:
-            nonlocal chunksize
-            nonlocal startoffset
-            nonlocal endoffset
-            nonlocal data
+        # Scan the file in large windows, letting bytes.find do the comparing. Each
+        # window keeps the tail end of the previous window so that matches which
+        # straddle a window boundary are still found.
+        chunksize = max(searchlen, self.IO_SIZE) * 8
+        readoffset = searchstart
+        nextmatch = searchstart
+        data = b""
 
-            # Load the next chunk of data, including changes.
-            newdata = self[endoffset:(endoffset + chunksize)]
+        while readoffset < searchend:
+            newdata = self[readoffset:min(readoffset + chunksize, searchend)]
             if not newdata:
-                return False
+                break
+            data = (data[-(searchlen - 1):] + newdata) if (searchlen > 1 and data) else newdata
+            readoffset += len(newdata)
+            dataoffset = readoffset - len(data)
+
+            # Find all of the matches in this window that we haven't already found.
+            position = max(nextmatch - dataoffset, 0)
+            while True:
+                found = data.find(search, position)
+                if found < 0:
+                    break
+
+                matchoffset = dataoffset + found
+                if matchoffset % alignment:
+                    # Not a valid match, keep looking after it.
+                    position = found + 1
+                    continue
+
+                yield matchoffset
+                nextmatch = matchoffset + (1 if overlapping else searchlen)
+                position = nextmatch - dataoffset
+
+    def __len__(self) -> int:
+        if self.__unsafe:
+            raise Exception("Another FileBytes instance representing the same file was written back!")
+        return self.__patchlength
 
-            # Stick the data on the end of the cache.
-            data = data + newdata
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, (bytes, bytearray, FileBytes)):
+            return NotImplemented
+        if len(self) != len(other):
+            # Can't possibly be the same, so don't bother looking.
+            return False
+        return self.compare(other) is None
+
+    def compare(
+        self,
+        other: Union[bytes, bytearray, "FileBytes"],
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+    ) -> Optional[int]:
+        if self.__unsafe or (isinstance(other, FileBytes) and other.__unsafe):
+            raise Exception("Another FileBytes instance representing the same file was written back!")
 
-            # Update the end offset pointer so we know were to load from next time.
-            endoffset += len(newdata)
+        # Find the first offset between start and end where our contents differ from the
+        # other data, or None if they are the same. Anything past the end of one side but
+        # not the other counts as a difference.
+        otherlength = len(other)
+        comparestart = 0 if start is None else max(start, 0)
+        compareend = max(self.__patchlength, otherlength)
+        if end is not None:
+            compareend = min(end, compareend)
+        if compareend <= comparestart:
+            return None
 
-            # If we got too long, then truncate ourselves so we don't blow up
-            # our memory searching the file.
-            if len(data) >= (3 * chunksize):
-                data = data[chunksize:]
-                startoffset += chunksize
+        common = min(compareend, self.__patchlength, otherlength)
+        if comparestart < common:
+            if isinstance(other, FileBytes) and other.__source is self.__source:
+                # We're both looking at the same file, so we only need to look at what
+                # either one of us has changed.
+                found = self.__compare_shared(other, comparestart, common)
+            else:
+                found = self.__compare_range(other, comparestart, common)
+            if found is not None:
+                return found
 
-            return True
+        if common < compareend:
+            # One side ends before the other does.
+            return max(common, comparestart)
+        return None
 
-        for offset in range(searchstart, searchend):
-            start = offset
-            end = offset + searchlen
+    def __mismatch(self, mine: Union[bytes, bytearray], theirs: Union[bytes, bytearray]) -> int:
+        # Find the first differing offset between two different runs of bytes of the same
+        # length, by repeatedly narrowing down which half the difference is in.
+        lo = 0
+        hi = len(mine)
+        while (hi - lo) > 64:
+            mid = (lo + hi) // 2
+            if mine[lo:mid] != theirs[lo:mid]:
+                hi = mid
+            else:
+                lo = mid
+        for offset in range(lo, hi):
+            if mine[offset] != theirs[offset]:
+                return offset
+        raise Exception("Logic error, data that was different is somehow the same!")
+
+    def __compare_range(self, other: Union[bytes, bytearray, "FileBytes"], start: int, stop: int) -> Optional[int]:
+        # Stream both sides in blocks, stopping at the first block that differs.
+        blocksize = self.IO_SIZE * 8
+        mine = bytearray(min(blocksize, stop - start))
+        theirs = bytearray(len(mine)) if isinstance(other, FileBytes) else None
+        for offset in range(start, stop, blocksize):
+            length = min(blocksize, stop - offset)
+            self.__readinto(offset, memoryview(mine)[:length])
+            myblock = mine if length == len(mine) else mine[:length]
+            theirblock: Union[bytes, bytearray]
+            if isinstance(other, FileBytes) and theirs is not None:
+                other.__readinto(offset, memoryview(theirs)[:length])
+                theirblock = theirs if length == len(theirs) else theirs[:length]
+            else:
+                theirblock = other[offset:(offset + length)]
 
-            if end > endoffset:
-                if not addchunk():
-                    # No more chunks left to search, and we hit the end of the
-                    # current chunk, so we have no more data to find.
-                    return None
+            if myblock != theirblock:
+                return offset + self.__mismatch(myblock, theirblock)
+        return None
 
-            actualstart = start - startoffset
-            actualend = end - startoffset
+    def __compare_shared(self, other: "FileBytes", start: int, stop: int) -> Optional[int]:
+        # Both of us read from the same file, so anything that maps onto the same place in
+        # it and hasn't been changed by either of us must be the same. Split the range up
+        # wherever either side's mapping or changes start or stop, and only look at the
+        # pieces in between that might differ.
+        mine = self.__patches.extract(start, stop)
+        theirs = other.__patches.extract(start, stop)
+        points = {start, stop}
+        for pieces in (self.__pieces, other.__pieces):
+            for piecestart, _, length in pieces.ranges(start, stop):
+                points.add(piecestart)
+                points.add(piecestart + length)
+        for extents in (mine, theirs):
+            for offset, data in extents:
+                points.add(start + offset)
+                points.add(start + offset + len(data))
+
+        mystarts = [start + offset for offset, _ in mine]
+        theirstarts = [start + offset for offset, _ in theirs]
+        ordered = sorted(points)
+        for lo, hi in zip(ordered, ordered[1:]):
+            mydata = self.__changed(mine, mystarts, lo, hi)
+            theirdata = self.__changed(theirs, theirstarts, lo, hi)
+            if mydata is None and theirdata is None:
+                if self.__pieces.find(lo) == other.__pieces.find(lo):
+                    # Neither side changed this, and it's the same part of the file.
+                    continue
 
-            # If this chunk looks like a match, then return the start index.
-            if data[actualstart:actualend] == search:
-                return start
+                # Data has moved around on one side, so we have to actually look.
+                found = self.__compare_range(other, lo, hi)
+                if found is not None:
+                    return found
+                continue
 
-        # Could not find the data.
+            # At least one side has changes here, so we only need to read the other.
+            if mydata is None:
+                mydata = self[lo:hi]
+            if theirdata is None:
+                theirdata = other[lo:hi]
+            if mydata != theirdata:
+                return lo + self.__mismatch(mydata, theirdata)
         return None
 
-    def __len__(self) -> int:
-        if self.__unsafe:
-            raise Exception("Another FileBytes instance representing the same file was written back!")
-        return self.__patchlength
+    def __changed(self, extents: List[Tuple[int, bytes]], starts: List[int], lo: int, hi: int) -> Optional[bytes]:
+        # Return the changed data between lo and hi, if there is any. The range never
+        # straddles the edge of a change.
+        index = bisect_right(starts, lo) - 1
+        if index >= 0 and lo < (starts[index] + len(extents[index][1])):
+            rel = lo - starts[index]
+            return extents[index][1][rel:(rel + hi - lo)]
+        return None
 
     def __add__(self, other: object) -> "FileBytes":
         if self.__unsafe:
@@ -122,15 +1280,21 @@ class FileBytes:
         return clone
 
     def clone(self) -> "FileBytes":
-        # Make a safe copy so that in-memory patches can be changed.
-        myclone = FileBytes(self.__handle)
-        myclone.__patches = {k: v for k, v in self.__patches.items()}
-        myclone.__lowest_patch = self.__lowest_patch
-        myclone.__highest_patch = self.__highest_patch
-        myclone.__regions = self.__regions
-        myclone.__filelength = self.__filelength
+        # Make a safe copy so that in-memory patches can be changed. Constructing it
+        # seeks the shared handle, so make sure no other reader is using it.
+        with self.__source.lock:
+            myclone = FileBytes(self.__handle)
+        myclone.__source = self.__source
+        # Both of us continue on top of a shared, frozen copy of our current changes, so
+        # that cloning doesn't need to copy them.
+        base = self.__patches.freeze()
+        self.__patches = _Overlay(base, self.__stats)
+        myclone.__patches = _Overlay(base, self.__stats)
+        myclone.__stats = self.__stats
+        myclone.__pieces = self.__pieces.copy()
         myclone.__patchlength = self.__patchlength
         myclone.__origfilelength = self.__origfilelength
+        myclone.__journal = [] if self.__journal is not None else None
 
         # Make sure we can invalidate copies if we write back the data.
         myclone.__copies.append(self)
@@ -144,16 +1308,69 @@ class FileBytes:
 
         # Add data to the end of our representation.
         data = data[:]
-        lowest_loc = self.__patchlength
-        highest_loc = self.__patchlength + len(data)
+        before = self.__capture(self.__patchlength, self.__patchlength)
+        self.__patches.write(self.__patchlength, data)
+        self.__patchlength += len(data)
+        self.__record(self.__patchlength - len(data), self.__patchlength, before)
 
-        for off, change in enumerate(data):
-            self.__patches[self.__patchlength + off] = change
+    def pad(self, size: int, fill: int = 0) -> None:
+        if self.__unsafe:
+            raise Exception("Another FileBytes instance representing the same file was written back!")
+
+        # Grow the resulting data to size, filling the new space with the fill byte.
+        if fill < 0 or fill > 255:
+            raise ValueError("Fill must be a valid byte value!")
+        if size <= self.__patchlength:
+            # We are already this long?
+            return
 
-        self.__lowest_patch = min(self.__lowest_patch, lowest_loc) if self.__lowest_patch is not None else lowest_loc
-        self.__highest_patch = max(self.__highest_patch, highest_loc + 1) if self.__highest_patch is not None else (highest_loc + 1)
-        self.__regions.clear()
-        self.__patchlength = highest_loc
+        before = self.__capture(self.__patchlength, self.__patchlength)
+        if fill != 0:
+            # Non-zero padding needs to be stored, but as a single block of changes.
+            self.__patches.write(self.__patchlength, bytes([fill]) * (size - self.__patchlength))
+
+        # Anything past the end of the file that isn't covered by a change reads as zero,
+        # so zero padding costs nothing more than remembering the new length.
+        oldlength = self.__patchlength
+        self.__patchlength = size
+        self.__record(oldlength, size, before)
+
+    def insert(self, offset: int, data: Union[bytes, "FileBytes"]) -> None:
+        if self.__unsafe:
+            raise Exception("Another FileBytes instance representing the same file was written back!")
+
+        # Support negative indexing, and inserting at the very end.
+        if offset < 0:
+            offset = self.__patchlength + offset
+        if offset < 0 or offset > self.__patchlength:
+            raise IndexError("FileBytes index out of range")
+
+        # Move everything past the insertion point up to make room, and then fill the
+        # gap that leaves with the new data.
+        data = data[:]
+        if not data:
+            return
+        before = self.__capture(offset, offset)
+        self.__pieces.insert(offset, len(data))
+        self.__patches.insert(offset, len(data))
+        self.__patches.write(offset, data)
+        self.__patchlength += len(data)
+        self.__record(offset, offset + len(data), before)
+
+    def delete(self, start: int, stop: Optional[int] = None) -> None:
+        if self.__unsafe:
+            raise Exception("Another FileBytes instance representing the same file was written back!")
+
+        # Remove the data between start and stop (or the end, if not given), resolving
+        # negative indexes and clamping the same way that slicing would.
+        start, stop, _ = slice(start, stop).indices(self.__patchlength)
+        if stop <= start:
+            return
+        before = self.__capture(start, stop)
+        self.__pieces.delete(start, stop)
+        self.__patches.delete(start, stop)
+        self.__patchlength -= stop - start
+        self.__record(start, start, before)
 
     def truncate(self, size: int) -> None:
         if self.__unsafe:
@@ -166,101 +1383,351 @@ class FileBytes:
             # We are already this short?
             return
 
-        # Set the file length to this size so we don't read anything past it.
-        if size < self.__filelength:
-            self.__filelength = size
+        # Make sure we don't read anything from the file past this size.
+        before = self.__capture(size, self.__patchlength)
+        self.__pieces.truncate(size)
 
         # Get rid of any changes made in the truncation range.
-        cleared: bool = False
-        for off in range(size, self.__patchlength):
-            if off in self.__patches:
-                del self.__patches[off]
-                cleared = True
-        if cleared:
-            self.__regions.clear()
+        self.__patches.truncate(size)
 
         # Set the length of this object to the size as well so resizing will
         # zero out the data.
         self.__patchlength = size
+        self.__record(size, size, before)
+
+    def __capture(self, start: int, stop: int) -> Optional[_Region]:
+        # Save a copy of a range of our representation that is about to be edited, so
+        # that the edit can be undone. This never needs to read from the file itself.
+        if self.__journal is None:
+            return None
+        return (stop - start, self.__pieces.extract(start, stop), self.__patches.extract(start, stop))
 
-    def __gather(self, already: Set["FileBytes"], need: "FileBytes") -> None:
+    def __record(self, start: int, stop: int, before: Optional[_Region]) -> None:
+        # Journal an edit which replaced the range saved in before with start to stop.
+        if self.__journal is None or before is None:
+            return
+        after = self.__capture(start, stop)
+        if after is None:
+            raise Exception("Logic error, journaling was turned off mid-edit!")
+
+        if self.__journalpos < len(self.__journal):
+            # Making a new edit after undoing means the undone edits can't be redone,
+            # along with any snapshots taken in between.
+            del self.__journal[self.__journalpos:]
+            self.__snapshots = {
+                name: position for name, position in self.__snapshots.items()
+                if position <= self.__journalpos
+            }
+        self.__journal.append((start, before, after))
+        self.__journalpos += 1
+
+    def __replace(self, start: int, length: int, region: _Region) -> None:
+        # Swap the range from start of a given length for a previously saved region.
+        regionlength, pieces, extents = region
+        if length:
+            self.__pieces.delete(start, start + length)
+            self.__patches.delete(start, start + length)
+        if regionlength:
+            self.__pieces.insert(start, regionlength)
+            self.__patches.insert(start, regionlength)
+            self.__pieces.paste(start, pieces)
+            for offset, data in extents:
+                self.__patches.write(start + offset, data)
+        self.__patchlength += regionlength - length
+
+    def __journaled(self) -> List[Tuple[int, _Region, _Region]]:
+        if self.__unsafe:
+            raise Exception("Another FileBytes instance representing the same file was written back!")
+        if self.__journal is None:
+            raise Exception("Journaling was not enabled for this FileBytes instance!")
+        return self.__journal
+
+    def undo(self) -> bool:
+        # Undo the most recent edit, returning whether there was anything to undo.
+        journal = self.__journaled()
+        if self.__journalpos == 0:
+            return False
+        self.__journalpos -= 1
+        start, before, after = journal[self.__journalpos]
+        self.__replace(start, after[0], before)
+        return True
+
+    def redo(self) -> bool:
+        # Redo the most recently undone edit, returning whether there was anything to redo.
+        journal = self.__journaled()
+        if self.__journalpos == len(journal):
+            return False
+        start, before, after = journal[self.__journalpos]
+        self.__journalpos += 1
+        self.__replace(start, before[0], after)
+        return True
+
+    def snapshot(self, name: str) -> None:
+        # Remember where we are in the journal, so that we can come back here later.
+        self.__journaled()
+        self.__snapshots[name] = self.__journalpos
+
+    def restore(self, name: str) -> None:
+        # Undo or redo edits until we're back to where we were when a snapshot was taken.
+        self.__journaled()
+        if name not in self.__snapshots:
+            raise ValueError(f"Unknown snapshot {name}!")
+        position = self.__snapshots[name]
+        while self.__journalpos > position:
+            self.undo()
+        while self.__journalpos < position:
+            self.redo()
+
+    def __gather(self, already: Dict[int, "FileBytes"], need: "FileBytes") -> None:
+        # Instances compare by contents and so can't be hashed, so key them by identity.
         for inst in need.__copies:
-            if inst not in already:
-                already.add(inst)
+            if id(inst) not in already:
+                already[id(inst)] = inst
                 self.__gather(already, inst)
 
-    def __write_changes(self, handle: BinaryIO) -> None:
-        locations = sorted(self.__patches.keys())
-        keys: Set[int] = set(locations)
-        handled: Set[int] = set()
-        for location in locations:
-            if location in handled:
-                # Already wrote this in a chunk.
-                continue
-
-            # Figure out the maximum range for this chunk.
-            start = location
-            end = location + 1
-            while end in keys:
-                end += 1
-
-            # Sum it up
-            data = bytes(self.__patches[loc] for loc in range(start, end))
-
-            # Write it
+    def __write_changes(self, handle: BinaryIO) -> int:
+        # Extents are already coalesced, so each one is a maximal run of changes. Returns
+        # the offset just past the last byte written.
+        end = 0
+        for start, data in self.__patches.extents():
             handle.seek(start)
             handle.write(data)
-
-            # Mark it complete
-            handled.update(range(start, end))
-
-        if keys != handled:
-            raise Exception("Logic error, failed to write some data!")
-
-    def write_changes(self, new_file: Optional[BinaryIO] = None) -> None:
+            end = start + len(data)
+            if self.__stats is not None:
+                self.__stats.seeks += 1
+                self.__stats.bytes_written += len(data)
+        return end
+
+    def __write_zeros(self, handle: BinaryIO, count: int) -> None:
+        # Write zero padding to the current position of a file without allocating the
+        # whole run of zeros at once.
+        while count > 0:
+            amount = min(count, self.IO_SIZE * 8)
+            handle.write(bytes(amount))
+            count -= amount
+
+    def __copy_range(self, new_file: BinaryIO, start: int, stop: int) -> None:
+        # Copy an untouched range of our representation to the current position of the
+        # new file. Anything that isn't part of the original file is zero-filled.
+        position = start
+        for piecestart, fileoffset, length in self.__pieces.ranges(start, stop):
+            if position < piecestart:
+                self.__write_zeros(new_file, piecestart - position)
+            self.__copy_file(new_file, fileoffset, fileoffset + length)
+            position = piecestart + length
+        if position < stop:
+            self.__write_zeros(new_file, stop - position)
+
+    def __copy_file(self, new_file: BinaryIO, start: int, stop: int) -> None:
+        # Copy a range of the original file to the current position of the new file.
+        start += self.__kernel_copy(new_file, start, stop)
+        while start < stop:
+            data = self.__source.read(start, min(stop - start, self.IO_SIZE * 8))
+            if not data:
+                raise Exception("Logic error, original file is shorter than expected!")
+            new_file.write(data)
+            start += len(data)
+
+    def __kernel_copy(self, new_file: BinaryIO, start: int, stop: int) -> int:
+        # When both sides are plain files, ask the OS to copy the range directly without
+        # bringing it into Python at all. Returns how many bytes were copied, which may be
+        # zero if this isn't possible, in which case the caller copies the rest itself.
+        if not hasattr(os, "copy_file_range") and not hasattr(os, "sendfile"):
+            return 0
+        srcfd = _FileSource.fileno(self.__handle)
+        dstfd = _FileSource.fileno(new_file)
+        if srcfd is None or dstfd is None:
+            return 0
+
+        # Make sure anything buffered is on disk before we copy around the buffers.
+        new_file.flush()
+        dstoffset = new_file.tell()
+        copied = 0
+        try:
+            while start + copied < stop:
+                if hasattr(os, "copy_file_range"):
+                    amount = os.copy_file_range(srcfd, dstfd, stop - (start + copied), start + copied, dstoffset + copied)
+                else:
+                    os.lseek(dstfd, dstoffset + copied, os.SEEK_SET)
+                    amount = os.sendfile(dstfd, srcfd, start + copied, stop - (start + copied))
+                if amount <= 0:
+                    break
+                copied += amount
+        except OSError:
+            # Not supported between these two files, fall back to copying ourselves.
+            pass
+
+        # Resync the buffered file's position with what we wrote underneath it.
+        new_file.seek(dstoffset + copied)
+        return copied
+
+    def __stream_changes(self, new_file: BinaryIO) -> None:
+        # Write our whole contents to a new file in a single sequential pass, copying
+        # untouched parts of the original file and splicing in our changes as we reach them.
+        new_file.seek(0)
+        position = 0
+        for start, data in self.__patches.extents():
+            self.__copy_range(new_file, position, start)
+            new_file.write(data)
+            position = start + len(data)
+        self.__copy_range(new_file, position, self.__patchlength)
+
+        # Now, make sure the new file is exactly the right length in case it was longer
+        # to begin with. Streams that can't be truncated, such as a compressed file being
+        # written, can't have had anything past what we just wrote anyway.
+        try:
+            new_file.truncate(self.__patchlength)
+        except (AttributeError, io.UnsupportedOperation):
+            pass
+
+    def __log_changes(self, undo_log: str, filelength: Optional[int], fsync: bool) -> None:
+        # Figure out which parts of the original file an in-place write will overwrite.
+        # If nothing has moved that is only what we've patched plus anything we truncate,
+        # otherwise the whole file gets rewritten so all of it needs saving.
+        ranges: List[Tuple[int, int]] = []
+        if filelength is None:
+            if self.__origfilelength > 0:
+                ranges.append((0, self.__origfilelength))
+        else:
+            for start, data in self.__patches.extents():
+                stop = min(start + len(data), self.__origfilelength)
+                if start >= stop:
+                    continue
+                if ranges and ranges[-1][1] == start:
+                    ranges[-1] = (ranges[-1][0], stop)
+                else:
+                    ranges.append((start, stop))
+            if filelength < self.__origfilelength:
+                ranges.append((filelength, self.__origfilelength))
+                ranges.sort()
+
+        _UndoLog.write(undo_log, self.__source, self.__origfilelength, ranges, fsync, self.IO_SIZE * 8)
+
+    @staticmethod
+    def recover(handle: BinaryIO, undo_log: str, *, fsync: bool = False) -> bool:
+        # Roll back an in-place write_changes() that was interrupted, given the undo log it
+        # was asked to keep. Returns True if the file was restored to how it was before the
+        # write, or False if there was nothing to undo.
+        if not os.path.exists(undo_log):
+            return False
+
+        with open(undo_log, "rb") as log:
+            length = _UndoLog.valid(log, FileBytes.IO_SIZE * 8)
+            if length is not None:
+                for offset, data in _UndoLog.records(log, FileBytes.IO_SIZE * 8):
+                    handle.seek(offset)
+                    handle.write(data)
+                handle.truncate(length)
+                handle.flush()
+                if fsync:
+                    _UndoLog.sync(handle)
+
+        # Either we restored the file, or the log itself was never finished, in which case
+        # the file was never touched. Either way, the log is no longer needed.
+        os.remove(undo_log)
+        if fsync:
+            _UndoLog.sync_directory(undo_log)
+        return length is not None
+
+    def write_changes(
+        self,
+        new_file: Optional[BinaryIO] = None,
+        *,
+        undo_log: Optional[str] = None,
+        fsync: bool = False,
+    ) -> None:
         if self.__unsafe:
             raise Exception("Another FileBytes instance representing the same file was written back!")
+        if undo_log is not None and new_file is not None:
+            raise ValueError("An undo log can only be used when writing changes back in place!")
+        if new_file is None and isinstance(self.__handle, _BufferHandle):
+            self.__handle.check(self.__patchlength)
 
         if new_file is not None:
             # We want to serialize this out to a new file altogether.
-            self.__handle.seek(0)
-            new_file.seek(0)
-            shutil.copyfileobj(self.__handle, new_file)
-
-            # Now, truncate the new file to the right length.
-            if self.__filelength < self.__origfilelength:
-                new_file.truncate(self.__filelength)
-
-            # Now, gather up any changes to the file and write them back.
-            self.__write_changes(new_file)
+            self.__stream_changes(new_file)
             new_file.flush()
+            if fsync:
+                _UndoLog.sync(new_file)
+            if self.__stats is not None:
+                self.__stats.bytes_written += self.__patchlength
         else:
-            # First off, see if we need to truncate the file.
-            if self.__filelength < self.__origfilelength:
-                self.__handle.truncate(self.__filelength)
-                self.__origfilelength = self.__filelength
-            if self.__filelength > self.__origfilelength:
-                raise Exception("Logic error, somehow resized file bigger than it started?")
-
-            # Now, gather up any changes to the file and write them back.
-            self.__write_changes(self.__handle)
-
-            # Now that we've serialized out the data, clean up our own representation.
-            self.__handle.flush()
-            self.__patches.clear()
-            self.__regions.clear()
-            self.__lowest_patch = None
-            self.__highest_patch = None
-            self.__filelength = self.__patchlength
+            # Hold the lock for the whole write so that nobody falling back to seeking
+            # and reading the shared handle interleaves with us.
+            with self.__source.lock:
+                filelength = self.__pieces.identity()
+                if undo_log is not None:
+                    # Save everything we're about to overwrite before touching the file, so
+                    # that a write which never finishes can be rolled back with recover().
+                    self.__log_changes(undo_log, filelength, fsync)
+                if filelength is None:
+                    # Data has been inserted or deleted, so parts of the file have moved
+                    # and it can't be patched in place without clobbering data we still
+                    # need to read. Stream the result to a temporary file and copy it back.
+                    # Only what is copied back to our own file counts as written.
+                    with tempfile.TemporaryFile() as temp:
+                        self.__stream_changes(temp)
+                        self.__source.unmap()
+                        temp.seek(0)
+                        self.__handle.seek(0)
+                        while True:
+                            block = temp.read(self.IO_SIZE * 8)
+                            if not block:
+                                break
+                            self.__handle.write(block)
+                        self.__handle.truncate(self.__patchlength)
+                        if self.__stats is not None:
+                            self.__stats.seeks += 1
+                            self.__stats.bytes_written += self.__patchlength
+                else:
+                    # First off, see if we need to truncate the file. Any existing mapping of
+                    # the file needs to go away first, since the file is about to change size.
+                    self.__source.unmap()
+                    if filelength < self.__origfilelength:
+                        self.__handle.truncate(filelength)
+                        self.__origfilelength = filelength
+                    if filelength > self.__origfilelength:
+                        raise Exception("Logic error, somehow resized file bigger than it started?")
+
+                    # Now, gather up any changes to the file and write them back, making sure
+                    # to write out any zero padding at the end that isn't part of the changes.
+                    end = max(self.__write_changes(self.__handle), filelength)
+                    if end < self.__patchlength:
+                        self.__handle.seek(end)
+                        self.__write_zeros(self.__handle, self.__patchlength - end)
+                        if self.__stats is not None:
+                            self.__stats.seeks += 1
+                            self.__stats.bytes_written += self.__patchlength - end
+
+                # Now that we've serialized out the data, clean up our own representation.
+                # Only once the data is safely on disk can the undo log go away, which is
+                # what marks the write as having completed.
+                self.__handle.flush()
+                if fsync:
+                    _UndoLog.sync(self.__handle)
+                if undo_log is not None:
+                    os.remove(undo_log)
+                    if fsync:
+                        _UndoLog.sync_directory(undo_log)
+                self.__source.refresh()
+                self.__patches.clear()
+                self.__pieces = _PieceTable(self.__patchlength)
+                self.__origfilelength = self.__patchlength
+
+                # The journal refers to the file as it was, so it can't be used anymore.
+                if self.__journal is not None:
+                    self.__journal = []
+                self.__journalpos = 0
+                self.__snapshots = {}
 
             # Finally, find all other clones of this class and notify them that they're
             # unsafe, so that there isn't any surprise behavior if somebody clones a
             # FileBytes and then writes back to the underlying file on that clone. This
             # is because the only thing we have in memory is the patches we've made, so
             # if the underlying file is changed suddenly its all wrong.
-            notify: Set[FileBytes] = {self}
+            notify: Dict[int, FileBytes] = {id(self): self}
             self.__gather(notify, self)
-            for inst in notify:
+            for inst in notify.values():
                 if inst is self:
                     continue
 
@@ -269,45 +1736,185 @@ class FileBytes:
 
                 # Set up the clone so that if it is cloned itself, the clone will
                 # work since it can read directly from the updated file.
-                inst.__filelength = self.__filelength
+                inst.__pieces = self.__pieces.copy()
                 inst.__patchlength = self.__patchlength
                 inst.__origfilelength = self.__origfilelength
                 inst.__patches.clear()
-                inst.__regions.clear()
-                inst.__lowest_patch = None
-                inst.__highest_patch = None
 
     def __slice(self, key: slice) -> Tuple[int, int, int]:
-        # Determine step of slice
-        if key.step is None:
-            step = 1
-        else:
-            step = key.step
+        # Let Python resolve defaults, negative indexes and clamping exactly the
+        # same way that it would for a bytes object of our length.
+        return key.indices(self.__patchlength)
 
-        # Determine start of slice
-        if key.start is None:
-            start = 0 if step > 0 else (self.__patchlength - 1)
-        elif key.start < 0:
-            start = self.__patchlength + key.start
-        else:
-            start = key.start
+    def readinto(self, offset: int, buffer: Union[bytearray, memoryview]) -> int:
+        if self.__unsafe:
+            raise Exception("Another FileBytes instance representing the same file was written back!")
 
-        # Determine end of slice
-        if key.stop is None:
-            stop = self.__patchlength if step > 0 else -1
-        elif key.stop < 0:
-            stop = self.__patchlength + key.stop
-        else:
-            stop = key.stop
+        # Fill a caller-provided buffer with our contents starting at offset, without
+        # allocating any intermediate copies. Returns how many bytes were filled in,
+        # which will be less than the buffer length when reading near the end.
+        if offset < 0:
+            raise IndexError("FileBytes index out of range")
+        with memoryview(buffer) as view:
+            with view.cast("B") as flat:
+                length = max(min(len(flat), self.__patchlength - offset), 0)
+                self.__readinto(offset, flat[:length])
+                return length
+
+    def __readinto(self, offset: int, view: memoryview) -> None:
+        # Fill the entirety of view with the bytes at offset, including our overlay.
+        # Anything that doesn't come from the file is padding, or data that was added
+        # which the overlay will fill in below.
+        position = offset
+        for piecestart, fileoffset, length in self.__pieces.ranges(offset, offset + len(view)):
+            if position < piecestart:
+                view[(position - offset):(piecestart - offset)] = bytes(piecestart - position)
+            rel = piecestart - offset
+            if self.__source.readinto(fileoffset, view[rel:(rel + length)]) != length:
+                raise Exception("Logic error, original file is shorter than expected!")
+            position = piecestart + length
+        if position < offset + len(view):
+            view[(position - offset):] = bytes(offset + len(view) - position)
+
+        # Now we have to modify the data with our own overlay, if anything in this range
+        # was changed at all.
+        if self.__patches.intersects(offset, offset + len(view)):
+            self.__patches.apply(offset, view)
+            if self.__stats is not None:
+                self.__stats.overlay_hits += 1
+
+    def __hashed_blocks(self) -> Iterator[Tuple[int, int, Optional[int]]]:
+        # Split our contents into HASH_SIZE blocks, yielding each block's bounds and the
+        # offset in the file it comes from if it is an untouched run of the file.
+        for start in range(0, self.__patchlength, self.HASH_SIZE):
+            stop = min(start + self.HASH_SIZE, self.__patchlength)
+            fileoffset = self.__pieces.contiguous(start, stop)
+            if fileoffset is not None and self.__patches.intersects(start, stop):
+                fileoffset = None
+            yield start, stop, fileoffset
+
+    def __hash_limit(self) -> int:
+        # Enough cached hashes to cover every block of the file in two different layouts,
+        # so that hashing again right after an insert or delete still mostly hits.
+        return ((self.__origfilelength // self.HASH_SIZE) + 1) * 2
+
+    def crc32(self) -> int:
+        if self.__unsafe:
+            raise Exception("Another FileBytes instance representing the same file was written back!")
+
+        # Compute the CRC32 of our contents, including any changes. The CRC of each block
+        # of the file that is untouched is remembered, so that after making changes only
+        # the blocks that changed need to be read again. The blocks are then combined.
+        crc = 0
+        limit = self.__hash_limit()
+        for start, stop, fileoffset in self.__hashed_blocks():
+            if fileoffset is None:
+                blockcrc = zlib.crc32(self[start:stop])
+            else:
+                blockcrc = self.__source.hashed(
+                    self.__source.crcs, fileoffset, stop - start, limit, lambda: zlib.crc32(self[start:stop])
+                )
+            crc = _CRC32.combine(crc, blockcrc, stop - start)
+        return crc
 
-        if start < 0:
-            raise Exception("Logic error!")
-        if start >= self.__patchlength:
-            start = self.__patchlength
-        if stop >= self.__patchlength:
-            stop = self.__patchlength
+    def fingerprint(self) -> str:
+        if self.__unsafe:
+            raise Exception("Another FileBytes instance representing the same file was written back!")
 
-        return (start, stop, step)
+        # Compute a tree hash of our contents, including any changes. Each HASH_SIZE block
+        # is hashed with SHA-1, and then pairs of hashes are hashed together until there
+        # is only one left. Much like the CRC32, hashes of untouched blocks are remembered.
+        level: List[bytes] = []
+        limit = self.__hash_limit()
+        for start, stop, fileoffset in self.__hashed_blocks():
+            if fileoffset is None:
+                level.append(hashlib.sha1(self[start:stop]).digest())
+            else:
+                level.append(
+                    self.__source.hashed(
+                        self.__source.digests, fileoffset, stop - start, limit, lambda: hashlib.sha1(self[start:stop]).digest()
+                    )
+                )
+
+        if not level:
+            return hashlib.sha1(b"").hexdigest()
+        while len(level) > 1:
+            level = [
+                hashlib.sha1(b"".join(level[index:(index + 2)])).digest() if index + 1 < len(level) else level[index]
+                for index in range(0, len(level), 2)
+            ]
+        return level[0].hex()
+
+    def __digest(self, algorithm: str) -> str:
+        if self.__unsafe:
+            raise Exception("Another FileBytes instance representing the same file was written back!")
+
+        # Unlike a CRC, these can't be put together from the hashes of separate blocks, so
+        # the whole thing has to be streamed through the hash.
+        digest = hashlib.new(algorithm)
+        for _, chunk in self.chunks():
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    def sha1(self) -> str:
+        return self.__digest("sha1")
+
+    def md5(self) -> str:
+        return self.__digest("md5")
+
+    def chunks(
+        self,
+        size: Optional[int] = None,
+        *,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+    ) -> Iterator[Tuple[int, memoryview]]:
+        if self.__unsafe:
+            raise Exception("Another FileBytes instance representing the same file was written back!")
+
+        # Stream our contents in chunks of size bytes, yielding the offset and a view of
+        # each chunk. The same buffer is reused for every chunk, so a view is only valid
+        # until the next chunk is requested.
+        chunksize = (self.IO_SIZE * 8) if size is None else size
+        if chunksize < 1:
+            raise ValueError("Chunk size must be a positive integer!")
+        chunkstart = 0 if start is None else max(start, 0)
+        chunkend = self.__patchlength if end is None else min(end, self.__patchlength)
+        if chunkend <= chunkstart:
+            return
+
+        view = memoryview(bytearray(min(chunksize, chunkend - chunkstart)))
+        for offset in range(chunkstart, chunkend, chunksize):
+            chunk = view[:min(chunksize, chunkend - offset)]
+            self.__readinto(offset, chunk)
+            yield offset, chunk
+
+    def __strided(self, start: int, stop: int, step: int) -> bytes:
+        # Load the contiguous range covered by a strided read in large blocks, using the
+        # normal patch-aware slicing, and let bytes slicing pick out every step'th byte.
+        if self.__stats is not None:
+            self.__stats.slow_slices += 1
+        offsets = range(start, stop, step)
+        if step < 0:
+            # Gather these in forward order, and reverse them at the end.
+            offsets = offsets[::-1]
+        stride = abs(step)
+        first = offsets[0]
+        last = offsets[-1]
+
+        if stride >= self.IO_SIZE:
+            # The bytes are so far apart that loading the covered range would mostly
+            # be wasted effort, so just look them up one at a time.
+            data = bytes(self[off] for off in offsets)
+        else:
+            # Blocks are a multiple of the stride so each one starts on a wanted byte.
+            blocksize = stride * max((self.IO_SIZE * 8) // stride, 1)
+            data = b"".join(
+                self[off:min(off + blocksize, last + 1)][::stride]
+                for off in range(first, last + 1, blocksize)
+            )
+
+        return data[::-1] if step < 0 else data
 
     @overload
     def __getitem__(self, key: int) -> int:
@@ -330,13 +1937,17 @@ class FileBytes:
                 raise IndexError("FileBytes index out of range")
 
             # Look up in our modifications, and then fall back to the file.
-            if key in self.__patches:
-                return self.__patches[key]
+            patched = self.__patches.get(key)
+            if patched is not None:
+                if self.__stats is not None:
+                    self.__stats.overlay_hits += 1
+                return patched
             else:
-                if key >= self.__filelength:
-                    raise Exception("Logic error, should never fall through to loading file bytes in area enlarged by patches!")
-                self.__handle.seek(key)
-                return self.__handle.read(1)[0]
+                fileoffset = self.__pieces.find(key)
+                if fileoffset is None:
+                    # Padding that was never modified.
+                    return 0
+                return self.__source.byte(fileoffset)
 
         elif isinstance(key, slice):
             # Grab our iterators.
@@ -348,111 +1959,41 @@ class FileBytes:
                 return b""
             if start < stop and step < 0:
                 return b""
-
-            # Do we have any modifications to the file in this area?
-            if start >= self.__filelength and stop >= self.__filelength:
-                modifications = True
-            elif self.__lowest_patch is None or (start < self.__lowest_patch and stop < self.__lowest_patch):
-                modifications = False
-            elif self.__highest_patch is None or (start > self.__highest_patch and stop > self.__highest_patch):
-                modifications = False
+            if step != 1 and step != -1:
+                return self.__strided(start, stop, step)
+
+            # Do we have any modifications to the file in this area? Anything that isn't
+            # one contiguous run of the file needs padding, data that was added, or data
+            # from several places in the file, so it can't be read directly either.
+            if start > stop:
+                fileoffset = self.__pieces.contiguous(stop + 1, start + 1)
+                modifications = self.__patches.intersects(stop + 1, start + 1)
             else:
-                # Whether we should do the slow check or not.
-                check = False
-
-                if not self.__regions:
-                    # Recreate the index.
-                    last_index = -1
-                    for iterval in sorted(self.__patches.keys()):
-                        # Only attempt to update the region cache if we haven't already
-                        # seen something in this section.
-                        index = iterval // self.IO_SIZE
-                        if index != last_index:
-                            self.__regions.add(index)
-                            last_index = index
-
-                if start > stop:
-                    iterstart = stop + 1
-                    iterend = start + 1
-                else:
-                    iterstart = start
-                    iterend = stop
-
-                iterstart //= self.IO_SIZE
-                iterend //= self.IO_SIZE
-
-                if iterend == iterstart:
-                    iterend += 1
-
-                for index in range(iterstart, iterend):
-                    if index in self.__regions:
-                        check = True
-
-                if check:
-                    modifications = any(index in self.__patches for index in range(start, stop, step))
-                else:
-                    modifications = False
+                fileoffset = self.__pieces.contiguous(start, stop)
+                modifications = self.__patches.intersects(start, stop)
 
             # Now see if we can do any fast loading
             if start < stop and step == 1:
-                if not modifications:
+                if fileoffset is not None and not modifications:
                     # This is just a contiguous read
-                    self.__handle.seek(start)
-                    return self.__handle.read(stop - start)
+                    return self.__source.read(fileoffset, stop - start)
                 else:
-                    if start < self.__filelength:
-                        # We need to modify at least one of the bytes in this read.
-                        self.__handle.seek(start)
-                        data = [x for x in self.__handle.read(stop - start)]
-
-                        # Append any amount of data we need to read past the end of the file.
-                        if len(data) < stop - start:
-                            data.extend([0] * ((stop - start) - len(data)))
-                    else:
-                        data = [0] * (stop - start)
-
-                    # Now we have to modify the data with our own overlay.
-                    for off in range(start, stop):
-                        if off in self.__patches:
-                            data[off - start] = self.__patches[off]
-
+                    # We need to modify at least one of the bytes in this read.
+                    data = bytearray(stop - start)
+                    self.__readinto(start, memoryview(data))
                     return bytes(data)
             elif start > stop and step == -1:
                 start += 1
                 stop += 1
-                if not modifications:
+                if fileoffset is not None and not modifications:
                     # This is just a continguous read, reversed
-                    self.__handle.seek(stop)
-                    return self.__handle.read(start - stop)[::-1]
+                    return self.__source.read(fileoffset, start - stop)[::-1]
                 else:
-                    if stop < self.__filelength:
-                        self.__handle.seek(stop)
-                        data = [x for x in self.__handle.read(start - stop)]
-
-                        # Append any amount of data we need to read past the end of the file.
-                        if len(data) < start - stop:
-                            data.extend([0] * ((start - stop) - len(data)))
-                    else:
-                        data = [0] * (start - stop)
-
-                    # Now we have to modify the data with our own overlay.
-                    for index, off in enumerate(range(stop, start)):
-                        if off in self.__patches:
-                            data[index] = self.__patches[off]
-
+                    data = bytearray(start - stop)
+                    self.__readinto(stop, memoryview(data))
                     return bytes(data[::-1])
             else:
-                # Gotta load the slow way
-                resp: List[bytes] = []
-                for off in range(start, stop, step):
-                    if off in self.__patches:
-                        resp.append(bytes([self.__patches[off]]))
-                    else:
-                        if off >= self.__filelength:
-                            raise Exception("Logic error, should never fall through to loading file bytes in area enlarged by patches!")
-                        self.__handle.seek(off)
-                        resp.append(self.__handle.read(1))
-                return b"".join(resp)
+                raise Exception("Logic error, strided reads should have been handled already!")
 
         else:
             raise NotImplementedError("Not implemented!")
@@ -479,10 +2020,9 @@ class FileBytes:
             if key >= self.__patchlength:
                 raise IndexError("FileBytes index out of range")
 
-            self.__patches[key] = val
-            self.__lowest_patch = min(self.__lowest_patch, key) if self.__lowest_patch is not None else key
-            self.__highest_patch = max(self.__highest_patch, key + 1) if self.__highest_patch is not None else (key + 1)
-            self.__regions.clear()
+            before = self.__capture(key, key + 1)
+            self.__patches.write(key, bytes([val]))
+            self.__record(key, key + 1, before)
 
         elif isinstance(key, slice):
             if not isinstance(val, bytes):
@@ -490,34 +2030,40 @@ class FileBytes:
 
             # Grab our iterators.
             start, stop, step = self.__slice(key)
-            vallen = len(val)
-
-            if start == stop:
-                if vallen != 0:
-                    raise NotImplementedError("Cannot resize FileBuffer!")
-            if start > stop and step > 0:
-                if vallen != 0:
-                    raise NotImplementedError("Cannot resize FileBuffer!")
-            if start < stop and step < 0:
-                if vallen != 0:
-                    raise NotImplementedError("Cannot resize FileBuffer!")
+            offsets = range(start, stop, step)
 
             # Now, verify the patches are the right length. Make sure that if
             # somebody catches NotImplementedError that we don't partially
             # modify ourselves.
-            for index, _off in enumerate(range(start, stop, step)):
-                if index >= vallen:
-                    raise NotImplementedError("Cannot resize FileBuffer!")
-
-            if index != (vallen - 1):
+            if len(offsets) != len(val):
                 raise NotImplementedError("Cannot resize FileBuffer!")
-
-            # Finally, perform the modification.
-            for index, off in enumerate(range(start, stop, step)):
-                self.__patches[off] = val[index]
-                self.__lowest_patch = min(self.__lowest_patch, off) if self.__lowest_patch is not None else off
-                self.__highest_patch = max(self.__highest_patch, off + 1) if self.__highest_patch is not None else (off + 1)
-                self.__regions.clear()
+            if not offsets:
+                return
+
+            # Finally, perform the modification as a single block of changes.
+            first = min(offsets[0], offsets[-1])
+            last = max(offsets[0], offsets[-1])
+            before = self.__capture(first, last + 1)
+            if step == 1:
+                self.__patches.write(first, val)
+            elif step == -1:
+                self.__patches.write(first, val[::-1])
+            else:
+                if self.__stats is not None:
+                    self.__stats.slow_slices += 1
+                # Only write the bytes actually assigned, so that the untouched bytes
+                # between them never need to be read or stored.
+                if step < 0:
+                    offsets = offsets[::-1]
+                    val = val[::-1]
+                if len(offsets) > 1 and offsets.step >= self.IO_SIZE:
+                    # The bytes are so far apart that laying them out over the range they
+                    # cover would mostly be wasted effort, so write them one at a time.
+                    for index, off in enumerate(offsets):
+                        self.__patches.write(off, val[index:(index + 1)])
+                else:
+                    self.__patches.scatter(offsets[0], offsets.step, val)
+            self.__record(first, last + 1, before)
 
         else:
             raise NotImplementedError("Not implemented!")
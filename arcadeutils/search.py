@@ -0,0 +1,229 @@
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+from typing_extensions import Final
+
+from .binary import BinaryDiff
+from .filebytes import FileBytes
+
+
+class MultiSearch:
+
+    CHUNK_SIZE: Final[int] = FileBytes.IO_SIZE * 8
+
+    def __init__(self, patterns: Sequence[bytes]) -> None:
+        # Build an Aho-Corasick automaton for all of the patterns so that any number
+        # of them can be found with a single pass over the data.
+        self.__patterns: List[bytes] = []
+        for pattern in patterns:
+            if not pattern:
+                raise ValueError("Cannot search for an empty pattern!")
+            if pattern not in self.__patterns:
+                self.__patterns.append(pattern)
+
+        # First, build the trie of all patterns.
+        goto: List[Dict[int, int]] = [{}]
+        outputs: List[List[int]] = [[]]
+        for index, pattern in enumerate(self.__patterns):
+            state = 0
+            for byte in pattern:
+                if byte not in goto[state]:
+                    goto.append({})
+                    outputs.append([])
+                    goto[state][byte] = len(goto) - 1
+                state = goto[state][byte]
+            outputs[state].append(index)
+
+        # Now, compute failure links breadth-first, which lets every state inherit the
+        # outputs of the longest suffix that is also a state.
+        fail: List[int] = [0] * len(goto)
+        order: List[int] = [0]
+        queue: List[int] = list(goto[0].values())
+        order.extend(queue)
+        while queue:
+            nextqueue: List[int] = []
+            for state in queue:
+                for byte, child in goto[state].items():
+                    fallback = fail[state]
+                    while fallback and byte not in goto[fallback]:
+                        fallback = fail[fallback]
+                    fail[child] = goto[fallback].get(byte, 0)
+                    outputs[child] = outputs[child] + outputs[fail[child]]
+                    nextqueue.append(child)
+            order.extend(nextqueue)
+            queue = nextqueue
+
+        # Renumber the states so that all accepting states come first. That way the
+        # scan loop only needs a single comparison per byte to know if it must report.
+        renumbered = sorted(range(len(goto)), key=lambda state: 0 if outputs[state] else 1)
+        newid: List[int] = [0] * len(goto)
+        for new, old in enumerate(renumbered):
+            newid[old] = new
+        self.__accepting: int = sum(1 for state in outputs if state) * 256
+        self.__outputs: List[List[int]] = [outputs[old] for old in renumbered]
+
+        # Finally, flatten into a dense transition table, where each state is stored as
+        # the offset of its 256 entry row so that a transition is a single lookup.
+        delta: List[int] = [0] * (len(goto) * 256)
+        for state in order:
+            row = newid[state] * 256
+            failrow = newid[fail[state]] * 256
+            for byte in range(256):
+                if byte in goto[state]:
+                    delta[row + byte] = newid[goto[state][byte]] * 256
+                elif state == 0:
+                    delta[row + byte] = newid[0] * 256
+                else:
+                    delta[row + byte] = delta[failrow + byte]
+        self.__delta: List[int] = delta
+        self.__root: int = newid[0] * 256
+
+    @property
+    def patterns(self) -> List[bytes]:
+        return list(self.__patterns)
+
+    def search(
+        self,
+        data: Union[bytes, FileBytes],
+        *,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+    ) -> Dict[bytes, List[int]]:
+        # Scan the data once, reporting the offset of every occurence of every pattern.
+        found: List[List[int]] = [[] for _ in self.__patterns]
+
+        searchstart = 0 if start is None else max(start, 0)
+        searchend = len(data) if end is None else min(end, len(data))
+
+        delta = self.__delta
+        accepting = self.__accepting
+        outputs = self.__outputs
+        lengths = [len(pattern) for pattern in self.__patterns]
+        state = self.__root
+
+        for chunkstart in range(searchstart, searchend, self.CHUNK_SIZE):
+            chunk = data[chunkstart:min(chunkstart + self.CHUNK_SIZE, searchend)]
+            for position, byte in enumerate(chunk, chunkstart + 1):
+                state = delta[state + byte]
+                if state < accepting:
+                    for index in outputs[state >> 8]:
+                        found[index].append(position - lengths[index])
+
+        return {pattern: found[index] for index, pattern in enumerate(self.__patterns)}
+
+
+class MaskedSearch:
+
+    CHUNK_SIZE: Final[int] = FileBytes.IO_SIZE * 8
+
+    def __init__(self, pattern: Union[str, Sequence[Optional[int]]]) -> None:
+        # Accept either the same hex and wildcard syntax used in patches, such as
+        # "AA * CC DD", or a list of byte values with None standing in for wildcards.
+        if isinstance(pattern, str):
+            values = [BinaryDiff._convert(x) for x in pattern.split(" ") if x.strip()]
+        else:
+            values = list(pattern)
+        if not values:
+            raise ValueError("Cannot search for an empty pattern!")
+        for value in values:
+            if value is not None and (value < 0 or value > 255):
+                raise ValueError(f"Pattern value {value} is not a valid byte!")
+        self.__values: List[Optional[int]] = values
+
+        # Split the pattern into runs of fixed bytes so they can be compared in bulk.
+        runs: List[Tuple[int, bytes]] = []
+        runstart: Optional[int] = None
+        for offset, value in enumerate(values + [None]):
+            if value is not None and runstart is None:
+                runstart = offset
+            elif value is None and runstart is not None:
+                runs.append((runstart, bytes(v or 0 for v in values[runstart:offset])))
+                runstart = None
+
+        # The longest run is what we actually search for, since it will have the
+        # fewest false positives. The rest of the runs are verified at each candidate.
+        if runs:
+            anchor = max(runs, key=lambda run: len(run[1]))
+            runs.remove(anchor)
+            self.__anchor: Optional[Tuple[int, bytes]] = anchor
+        else:
+            self.__anchor = None
+        self.__runs: List[Tuple[int, bytes]] = runs
+
+    def __len__(self) -> int:
+        return len(self.__values)
+
+    def search(
+        self,
+        data: Union[bytes, FileBytes],
+        *,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+    ) -> Optional[int]:
+        # Search the data for the first occurence of the masked pattern.
+        for found in self.search_all(data, start=start, end=end):
+            return found
+
+        # Could not find the data.
+        return None
+
+    def search_all(
+        self,
+        data: Union[bytes, FileBytes],
+        *,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        overlapping: bool = False,
+        alignment: int = 1,
+    ) -> Iterator[int]:
+        # Find every occurence of the masked pattern in a single pass over the data.
+        if alignment < 1:
+            raise ValueError("Alignment must be a positive integer!")
+
+        searchlen = len(self.__values)
+        searchstart = 0 if start is None else start
+        searchend = len(data) if end is None else min(end, len(data))
+        if searchstart < 0 or (searchend - searchlen) < searchstart:
+            # Never going to find it anyway.
+            return
+
+        # Scan the data in large windows, keeping the tail end of the previous window
+        # so that matches which straddle a window boundary are still found.
+        chunksize = max(searchlen, FileBytes.IO_SIZE) * 8
+        readoffset = searchstart
+        nextmatch = searchstart
+        window = b""
+
+        while readoffset < searchend:
+            newdata = data[readoffset:min(readoffset + chunksize, searchend)]
+            if not newdata:
+                break
+            window = (window[-(searchlen - 1):] + newdata) if (searchlen > 1 and window) else newdata
+            readoffset += len(newdata)
+            windowoffset = readoffset - len(window)
+
+            position = max(nextmatch - windowoffset, 0)
+            while True:
+                # Find the next candidate, either by looking for the anchor or, for a
+                # pattern made entirely of wildcards, by just taking the next position.
+                if self.__anchor is not None:
+                    anchoroffset, anchor = self.__anchor
+                    found = window.find(anchor, position + anchoroffset)
+                    if found < 0:
+                        break
+                    candidate = found - anchoroffset
+                else:
+                    candidate = position
+                if (candidate + searchlen) > len(window):
+                    # This will be found again in the next window.
+                    break
+
+                if (windowoffset + candidate) % alignment or any(
+                    window[(candidate + runoffset):(candidate + runoffset + len(run))] != run
+                    for runoffset, run in self.__runs
+                ):
+                    # Not a valid match, keep looking after it.
+                    position = candidate + 1
+                    continue
+
+                yield windowoffset + candidate
+                nextmatch = windowoffset + candidate + (1 if overlapping else searchlen)
+                position = nextmatch - windowoffset
@@ -0,0 +1,147 @@
+import asyncio
+import io
+import random
+import unittest
+from typing import Any, Coroutine, TypeVar
+
+from arcadeutils import AsyncFileBytes, FileBytes
+
+
+_T = TypeVar("_T")
+
+
+class TestAsyncFileBytes(unittest.TestCase):
+
+    def __run(self, coro: Coroutine[Any, Any, _T]) -> _T:
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            loop.close()
+
+    def test_read(self) -> None:
+        data = bytes(random.getrandbits(8) for _ in range(AsyncFileBytes.BATCH_SIZE * 2 + 123))
+        afb = AsyncFileBytes(io.BytesIO(data))
+
+        async def test() -> None:
+            self.assertEqual(
+                len(afb),
+                len(data),
+            )
+            self.assertEqual(
+                await afb.read(5),
+                data[5],
+            )
+            self.assertEqual(
+                await afb.read(-1),
+                data[-1],
+            )
+            self.assertEqual(
+                await afb.read(slice(None)),
+                data,
+            )
+            self.assertEqual(
+                await afb.read(slice(100, AsyncFileBytes.BATCH_SIZE + 100)),
+                data[100:(AsyncFileBytes.BATCH_SIZE + 100)],
+            )
+            self.assertEqual(
+                await afb.read(slice(None, None, -3)),
+                data[::-3],
+            )
+            self.assertEqual(
+                await afb.read(slice(10, 5)),
+                b"",
+            )
+
+        self.__run(test())
+
+    def test_write(self) -> None:
+        data = bytearray(range(256)) * 1024
+        original = io.BytesIO(bytes(data))
+        fb = FileBytes(original)
+        afb = AsyncFileBytes(fb)
+        padded = len(data) + 10
+
+        async def test() -> None:
+            await afb.write(10, 0xFF)
+            await afb.write(slice(FileBytes.IO_SIZE - 2, FileBytes.IO_SIZE + 2), b"abcd")
+            await afb.write(slice(0, 100, 10), b"0123456789")
+            await afb.append(b"efgh")
+            await afb.pad(padded, 0x20)
+            clone = await afb.clone()
+            await clone.truncate(100)
+            await afb.append(clone)
+            await afb.insert(50, b"ijkl")
+            await afb.delete(200, 210)
+
+        data[10] = 0xFF
+        data[(FileBytes.IO_SIZE - 2):(FileBytes.IO_SIZE + 2)] = b"abcd"
+        data[0:100:10] = b"0123456789"
+        data.extend(b"efgh")
+        data.extend(b"\x20" * 6)
+        data.extend(data[:100])
+        data[50:50] = b"ijkl"
+        del data[200:210]
+        self.__run(test())
+
+        self.assertEqual(
+            fb[:],
+            data,
+        )
+        self.assertEqual(
+            self.__run(afb.read(slice(None))),
+            data,
+        )
+
+        handle = io.BytesIO()
+        self.__run(afb.write_changes(handle))
+        self.assertEqual(
+            handle.getvalue(),
+            data,
+        )
+
+        self.__run(afb.write_changes())
+        self.assertEqual(
+            original.getvalue(),
+            data,
+        )
+
+    def test_search(self) -> None:
+        data = bytearray(AsyncFileBytes.BATCH_SIZE * 3)
+        for offset in [5, AsyncFileBytes.BATCH_SIZE - 2, AsyncFileBytes.BATCH_SIZE + 3, AsyncFileBytes.BATCH_SIZE * 2 - 1, len(data) - 4]:
+            data[offset:(offset + 4)] = b"abab"
+        fb = FileBytes(io.BytesIO(bytes(data)))
+        afb = AsyncFileBytes(fb)
+
+        async def test() -> None:
+            self.assertEqual(
+                await afb.search(b"abab"),
+                5,
+            )
+            self.assertEqual(
+                await afb.search(b"abab", start=6),
+                AsyncFileBytes.BATCH_SIZE - 2,
+            )
+            self.assertEqual(
+                await afb.search(b"abab", start=AsyncFileBytes.BATCH_SIZE * 2),
+                len(data) - 4,
+            )
+            self.assertEqual(
+                await afb.search(b"abab", end=len(data) - 1, start=AsyncFileBytes.BATCH_SIZE * 2),
+                None,
+            )
+            self.assertEqual(
+                await afb.search(FileBytes(io.BytesIO(b"abab")), start=AsyncFileBytes.BATCH_SIZE),
+                AsyncFileBytes.BATCH_SIZE + 3,
+            )
+
+            for search in [b"abab", b"ab", b"ba\0"]:
+                for overlapping in [False, True]:
+                    for alignment in [1, 2, 3]:
+                        for start, end in [(None, None), (7, None), (AsyncFileBytes.BATCH_SIZE - 1, len(data) - 2)]:
+                            self.assertEqual(
+                                await afb.search_all(search, start=start, end=end, overlapping=overlapping, alignment=alignment),
+                                list(fb.search_all(search, start=start, end=end, overlapping=overlapping, alignment=alignment)),
+                            )
+
+        self.__run(test())
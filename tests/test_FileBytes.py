@@ -1,10 +1,27 @@
+import gzip
+import hashlib
 import io
 import random
+import tempfile
 import unittest
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, List, Optional, Union, cast
 
 from arcadeutils import FileBytes
 
 
+class CountingBytesIO(io.BytesIO):
+
+    def __init__(self, data: bytes) -> None:
+        super().__init__(data)
+        self.reads = 0
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        self.reads += 1
+        return super().read(size)
+
+
 class TestFileBytes(unittest.TestCase):
 
     def test_read_only_operations(self) -> None:
@@ -369,6 +386,98 @@ class TestFileBytes(unittest.TestCase):
             fb[3:4] = b"long"
         with self.assertRaises(NotImplementedError):
             fb[3:7] = b""
+        with self.assertRaises(NotImplementedError):
+            fb[3:7:2] = b"abc"
+        with self.assertRaises(NotImplementedError):
+            fb[3:3] = b"a"
+
+        # Make sure failed modifications didn't partially apply.
+        self.assertEqual(
+            fb[:],
+            b"0123456789",
+        )
+
+        # Empty assignments to empty ranges are fine.
+        fb[3:3] = b""
+        fb[7:3] = b""
+        self.assertEqual(
+            fb[:],
+            b"0123456789",
+        )
+
+    def test_modify_strided(self) -> None:
+        b = bytearray((bytes(range(251)) * (FileBytes.IO_SIZE // 10))[:(FileBytes.IO_SIZE * 4 + 123)])
+        fb = FileBytes(io.BytesIO(bytes(b)))
+
+        for step in [2, 3, -2, -5, FileBytes.IO_SIZE, -FileBytes.IO_SIZE]:
+            count = len(b[1::step])
+            data = bytes((i * 7) & 0xFF for i in range(count))
+            fb[1::step] = data
+            b[1::step] = data
+            self.assertEqual(
+                fb[:],
+                b,
+            )
+
+        # Verify that it gets serialized correctly.
+        fb.write_changes()
+        handle = fb.handle
+        if not isinstance(handle, io.BytesIO):
+            raise Exception("File handle changed type somehow!")
+        self.assertEqual(
+            handle.getvalue(),
+            b,
+        )
+
+    def test_modify_strided_sparse(self) -> None:
+        b = bytearray(bytes(range(256)) * (FileBytes.IO_SIZE // 64))
+        fb = FileBytes(io.BytesIO(bytes(b)), stats=True)
+        stats = fb.stats
+        if stats is None:
+            raise Exception("Stats were not enabled!")
+
+        # Assigning every other byte should neither read the bytes in between nor store
+        # them as changes, so only the assigned bytes get written back.
+        count = len(b[::2])
+        fb[::2] = bytes(count)
+        b[::2] = bytes(count)
+        self.assertEqual(
+            stats.bytes_read,
+            0,
+        )
+        fb.write_changes()
+        self.assertEqual(
+            stats.bytes_written,
+            count,
+        )
+        handle = fb.handle
+        if not isinstance(handle, io.BytesIO):
+            raise Exception("File handle changed type somehow!")
+        self.assertEqual(
+            handle.getvalue(),
+            b,
+        )
+
+        # Filling in the gaps afterwards should join everything back together.
+        stats.reset()
+        fb[::2] = b"\1" * count
+        fb[1::2] = b"\2" * count
+        b[::2] = b"\1" * count
+        b[1::2] = b"\2" * count
+        self.assertEqual(
+            stats.bytes_read,
+            0,
+        )
+        self.assertEqual(
+            fb[:],
+            b,
+        )
+        stats.reset()
+        fb.write_changes()
+        self.assertEqual(
+            stats.seeks,
+            1,
+        )
 
     def test_append_null(self) -> None:
         fb = FileBytes(io.BytesIO(b"0123456789"))
@@ -508,6 +617,86 @@ class TestFileBytes(unittest.TestCase):
             b"0123456789abcdef",
         )
 
+    def test_clone_independence(self) -> None:
+        fb = FileBytes(io.BytesIO(b"0123456789"))
+        fb[0:2] = b"ab"
+
+        clone = fb.clone()
+        self.assertEqual(
+            clone[:],
+            b"ab23456789",
+        )
+
+        # Changes after cloning must not leak in either direction, even when they
+        # modify bytes that were already changed before the clone.
+        fb[1] = ord("x")
+        clone[0] = ord("y")
+        clone[5] = ord("z")
+        self.assertEqual(
+            fb[:],
+            b"ax23456789",
+        )
+        self.assertEqual(
+            clone[:],
+            b"yb234z6789",
+        )
+
+        # Truncating and re-growing a clone must not resurrect the original's data.
+        fb[8:10] = b"cd"
+        clone2 = fb.clone()
+        clone2.truncate(7)
+        clone2.append(b"\0\0\0")
+        self.assertEqual(
+            clone2[:],
+            b"ax23456\0\0\0",
+        )
+        self.assertEqual(
+            clone2[8],
+            0,
+        )
+        self.assertEqual(
+            fb[:],
+            b"ax234567cd",
+        )
+
+        # Verify that it gets serialized correctly.
+        clone2.write_changes()
+        handle = clone2.handle
+        if not isinstance(handle, io.BytesIO):
+            raise Exception("File handle changed type somehow!")
+        self.assertEqual(
+            handle.getvalue(),
+            b"ax23456\0\0\0",
+        )
+
+    def test_clone_chains(self) -> None:
+        b = bytearray(b"0123456789" * 10)
+        fb = FileBytes(io.BytesIO(bytes(b)))
+
+        # Build a long chain of clones, each making its own change, and make sure
+        # every one of them sees exactly its own history.
+        clones = []
+        expected = []
+        for i in range(50):
+            fb[i] = ord("a") + (i % 26)
+            b[i] = ord("a") + (i % 26)
+            if i % 7 == 0:
+                fb.truncate(len(fb) - 1)
+                del b[-1]
+            clones.append(fb.clone())
+            expected.append(bytes(b))
+            fb = clones[-1].clone()
+
+        for clone, data in zip(clones, expected):
+            self.assertEqual(
+                clone[:],
+                data,
+            )
+            self.assertEqual(
+                clone[-1],
+                data[-1],
+            )
+
     def test_add(self) -> None:
         fb = FileBytes(io.BytesIO(b"0123456789"))
 
@@ -563,6 +752,93 @@ class TestFileBytes(unittest.TestCase):
             b"0123456789abcdef",
         )
 
+    def test_pad(self) -> None:
+        fb = FileBytes(io.BytesIO(b"0123456789"))
+
+        # Padding to a shorter length does nothing.
+        fb.pad(5)
+        self.assertEqual(
+            len(fb),
+            10,
+        )
+
+        # Zero and non-zero padding.
+        fb.pad(14)
+        fb.pad(16, 0xFF)
+        self.assertEqual(
+            len(fb),
+            16,
+        )
+        self.assertEqual(
+            fb[:],
+            b"0123456789\0\0\0\0\xff\xff",
+        )
+        self.assertEqual(
+            fb[12],
+            0,
+        )
+        self.assertEqual(
+            fb[::-3],
+            b"\xff\x009630",
+        )
+
+        # Modifying padding works like anything else.
+        fb[11] = ord("a")
+        self.assertEqual(
+            fb[8:],
+            b"89\0a\0\0\xff\xff",
+        )
+
+        with self.assertRaises(ValueError):
+            fb.pad(20, 256)
+
+        # Verify that it gets serialized correctly.
+        fb.write_changes()
+        handle = fb.handle
+        if not isinstance(handle, io.BytesIO):
+            raise Exception("File handle changed type somehow!")
+        self.assertEqual(
+            handle.getvalue(),
+            b"0123456789\0a\0\0\xff\xff",
+        )
+
+    def test_pad_large(self) -> None:
+        fb = FileBytes(io.BytesIO(b"0123456789"))
+
+        # Growing and shrinking by a lot should not store anything for zero padding.
+        fb.pad(FileBytes.IO_SIZE * 100)
+        fb[FileBytes.IO_SIZE * 50] = 1
+        self.assertEqual(
+            fb[-1],
+            0,
+        )
+        self.assertEqual(
+            fb[(FileBytes.IO_SIZE * 50 - 1):(FileBytes.IO_SIZE * 50 + 2)],
+            b"\0\x01\0",
+        )
+        fb.truncate(5)
+        fb.pad(FileBytes.IO_SIZE * 100)
+        self.assertEqual(
+            fb[FileBytes.IO_SIZE * 50],
+            0,
+        )
+
+        # Verify that it gets serialized correctly to a new file and in place.
+        new_file = io.BytesIO()
+        fb.write_changes(new_file)
+        self.assertEqual(
+            new_file.getvalue(),
+            b"01234" + bytes(FileBytes.IO_SIZE * 100 - 5),
+        )
+        fb.write_changes()
+        handle = fb.handle
+        if not isinstance(handle, io.BytesIO):
+            raise Exception("File handle changed type somehow!")
+        self.assertEqual(
+            handle.getvalue(),
+            b"01234" + bytes(FileBytes.IO_SIZE * 100 - 5),
+        )
+
     def test_truncate_noop(self) -> None:
         fb = FileBytes(io.BytesIO(b"0123456789"))
 
@@ -827,6 +1103,170 @@ class TestFileBytes(unittest.TestCase):
                 location,
             )
 
+    def test_search_window_boundaries(self) -> None:
+        # Place the search bytes straddling every window size the search could
+        # plausibly be using internally.
+        for boundary in [FileBytes.IO_SIZE, FileBytes.IO_SIZE * 8, FileBytes.IO_SIZE * 16]:
+            for shift in range(-4, 1):
+                location = boundary + shift
+                fb = FileBytes(io.BytesIO((b"\0" * location) + (b"12345") + (b"\0" * 100)))
+                self.assertEqual(
+                    fb.search(b"12345"),
+                    location,
+                )
+                self.assertEqual(
+                    fb.search(b"12345", start=location + 1),
+                    None,
+                )
+                self.assertEqual(
+                    fb.search(b"12345", end=location + 5),
+                    location,
+                )
+                self.assertEqual(
+                    fb.search(b"12345", end=location + 4),
+                    None,
+                )
+
+    def test_search_modified(self) -> None:
+        fb = FileBytes(io.BytesIO((b"\0" * 54321) + (b"0123456789") + (b"\0" * 54321)))
+
+        # Changing the file should be reflected in the search.
+        fb[54323] = ord("a")
+        self.assertEqual(
+            fb.search(b"0123456789"),
+            None,
+        )
+        self.assertEqual(
+            fb.search(b"01a3"),
+            54321,
+        )
+
+        # Searching through appended data should work as well.
+        fb.append(b"abcdef")
+        self.assertEqual(
+            fb.search(b"\0abc"),
+            len(fb) - 7,
+        )
+        self.assertEqual(
+            fb.search(FileBytes(io.BytesIO(b"def"))),
+            len(fb) - 3,
+        )
+        self.assertEqual(
+            fb.search(b""),
+            0,
+        )
+
+    def test_search_all(self) -> None:
+        fb = FileBytes(io.BytesIO(b"aaaa" + (b"\0" * (FileBytes.IO_SIZE * 8 - 6)) + b"aaaa" + b"\0aaa"))
+        length = len(fb)
+
+        # Non-overlapping matches.
+        self.assertEqual(
+            list(fb.search_all(b"aa")),
+            [0, 2, length - 8, length - 6, length - 3],
+        )
+
+        # Overlapping matches, including one that straddles a search window.
+        self.assertEqual(
+            list(fb.search_all(b"aa", overlapping=True)),
+            [0, 1, 2, length - 8, length - 7, length - 6, length - 3, length - 2],
+        )
+
+        # Aligned matches only.
+        self.assertEqual(
+            list(fb.search_all(b"aa", overlapping=True, alignment=4)),
+            [0, length - 6, length - 2],
+        )
+        self.assertEqual(
+            list(fb.search_all(b"aa", alignment=2)),
+            [0, 2, length - 8, length - 6, length - 2],
+        )
+
+        # Bounds.
+        self.assertEqual(
+            list(fb.search_all(b"aa", start=1, end=length - 5)),
+            [1, length - 8],
+        )
+        self.assertEqual(
+            list(fb.search_all(b"bb")),
+            [],
+        )
+
+        # Modifications are honored.
+        fb[1] = 0
+        fb.append(b"a")
+        self.assertEqual(
+            list(fb.search_all(b"aa")),
+            [2, length - 8, length - 6, length - 3, length - 1],
+        )
+
+        with self.assertRaises(ValueError):
+            list(fb.search_all(b"aa", alignment=0))
+
+    def test_search_all_random(self) -> None:
+        for _ in range(25):
+            b = bytes(random.choice(b"ab") for _ in range(random.randint(1, 2000)))
+            needle = bytes(random.choice(b"ab") for _ in range(random.randint(1, 4)))
+            fb = FileBytes(io.BytesIO(b))
+
+            expected = []
+            location = b.find(needle)
+            while location >= 0:
+                expected.append(location)
+                location = b.find(needle, location + 1)
+            self.assertEqual(
+                list(fb.search_all(needle, overlapping=True)),
+                expected,
+            )
+            self.assertEqual(
+                fb.search(needle),
+                expected[0] if expected else None,
+            )
+
+    def test_rsearch(self) -> None:
+        fb = FileBytes(io.BytesIO(b"0123" + (b"\0" * 54321) + b"0123" + (b"\0" * 54321) + b"01"))
+        self.assertEqual(
+            fb.rsearch(b"0123"),
+            54325,
+        )
+        self.assertEqual(
+            fb.rsearch(b"0123", end=54328),
+            0,
+        )
+        self.assertEqual(
+            fb.rsearch(b"0123", end=54329),
+            54325,
+        )
+        self.assertEqual(
+            fb.rsearch(b"0123", start=1, end=54328),
+            None,
+        )
+        self.assertEqual(
+            fb.rsearch(b"abcde"),
+            None,
+        )
+
+        # Modifications are honored.
+        fb.append(b"23")
+        self.assertEqual(
+            fb.rsearch(FileBytes(io.BytesIO(b"0123"))),
+            len(fb) - 4,
+        )
+        fb[-1] = 0
+        self.assertEqual(
+            fb.rsearch(b"0123"),
+            54325,
+        )
+
+    def test_rsearch_random(self) -> None:
+        for _ in range(25):
+            location = random.randint(1, FileBytes.IO_SIZE * 10)
+            fb = FileBytes(io.BytesIO((b"\0" * location) + (b"12345") + (b"\0" * random.randint(1, FileBytes.IO_SIZE * 10))))
+            self.assertEqual(
+                fb.rsearch(b"12345"),
+                location,
+            )
+
     def test_write_new_file(self) -> None:
         fb = FileBytes(io.BytesIO(b"0123456789"))
 
@@ -872,3 +1312,1416 @@ class TestFileBytes(unittest.TestCase):
             new_file.getvalue(),
             b"012ad5ebcf",
         )
+
+    def test_overlapping_modifications(self) -> None:
+        fb = FileBytes(io.BytesIO(b"0123456789"))
+
+        # Modifications that touch, overlap and swallow each other should
+        # all coalesce correctly.
+        fb[2:4] = b"ab"
+        fb[5:7] = b"cd"
+        fb[4] = 101
+        self.assertEqual(
+            fb[:],
+            b"01abecd789",
+        )
+        fb[1:8] = b"ABCDEFG"
+        self.assertEqual(
+            fb[:],
+            b"0ABCDEFG89",
+        )
+        fb[0:2] = b"zy"
+        fb[7:10] = b"xwv"
+        self.assertEqual(
+            fb[:],
+            b"zyBCDEFxwv",
+        )
+        self.assertEqual(
+            fb[3],
+            ord("C"),
+        )
+
+        # Verify that it gets serialized correctly.
+        fb.write_changes()
+        handle = fb.handle
+        if not isinstance(handle, io.BytesIO):
+            raise Exception("File handle changed type somehow!")
+        self.assertEqual(
+            handle.getvalue(),
+            b"zyBCDEFxwv",
+        )
+
+    def test_random_modifications(self) -> None:
+        for _ in range(25):
+            b = bytes(random.randint(0, 255) for _ in range(random.randint(1, 500)))
+            expected = bytearray(b)
+            fb = FileBytes(io.BytesIO(b))
+
+            for _ in range(50):
+                action = random.randint(0, 9)
+                if action == 0:
+                    data = bytes(random.randint(0, 255) for _ in range(random.randint(0, 50)))
+                    fb.append(data)
+                    expected.extend(data)
+                elif action == 1:
+                    size = random.randint(0, len(expected))
+                    fb.truncate(size)
+                    del expected[size:]
+                elif action == 2:
+                    size = len(expected) + random.randint(0, 50)
+                    fill = random.choice([0, 0, 0xFF])
+                    fb.pad(size, fill)
+                    expected.extend(bytes([fill]) * (size - len(expected)))
+                elif action == 3:
+                    offset = random.randint(0, len(expected))
+                    data = bytes(random.randint(0, 255) for _ in range(random.randint(0, 50)))
+                    fb.insert(offset, data)
+                    expected[offset:offset] = data
+                elif action == 4:
+                    start = random.randint(0, len(expected))
+                    end = random.randint(start, len(expected))
+                    fb.delete(start, end)
+                    del expected[start:end]
+                elif expected:
+                    start = random.randint(0, len(expected) - 1)
+                    end = random.randint(start, len(expected))
+                    data = bytes(random.randint(0, 255) for _ in range(end - start))
+                    fb[start:end] = data
+                    expected[start:end] = data
+
+                self.assertEqual(
+                    fb[:],
+                    expected,
+                )
+                if expected:
+                    start = random.randint(0, len(expected) - 1)
+                    end = random.randint(start, len(expected))
+                    self.assertEqual(
+                        fb[start:end],
+                        expected[start:end],
+                    )
+                    self.assertEqual(
+                        fb[end:start:-1],
+                        expected[end:start:-1],
+                    )
+
+            # Verify that it gets serialized correctly.
+            if expected:
+                offset = random.randint(0, len(expected) - 1)
+                self.assertEqual(
+                    fb[offset],
+                    expected[offset],
+                )
+            newfile = io.BytesIO()
+            fb.write_changes(newfile)
+            self.assertEqual(
+                newfile.getvalue(),
+                expected,
+            )
+            fb.write_changes()
+            handle = fb.handle
+            if not isinstance(handle, io.BytesIO):
+                raise Exception("File handle changed type somehow!")
+            self.assertEqual(
+                handle.getvalue(),
+                expected,
+            )
+
+    def test_mmap_read_modify_write(self) -> None:
+        with tempfile.TemporaryFile() as handle:
+            handle.write(b"0123456789")
+            handle.flush()
+            fb = FileBytes(handle, use_mmap=True)
+
+            # Verify reads come back correctly through the mapping.
+            self.assertEqual(
+                fb[:],
+                b"0123456789",
+            )
+            self.assertEqual(
+                fb[5],
+                ord("5"),
+            )
+            self.assertEqual(
+                fb[7:3:-1],
+                b"7654",
+            )
+
+            # Modify, grow and write back the file.
+            fb[3] = 97
+            fb.append(b"abc")
+            self.assertEqual(
+                fb[:],
+                b"012a456789abc",
+            )
+            fb.write_changes()
+            handle.seek(0)
+            self.assertEqual(
+                handle.read(),
+                b"012a456789abc",
+            )
+
+            # Make sure the mapping was refreshed to see the new length.
+            self.assertEqual(
+                fb[:],
+                b"012a456789abc",
+            )
+            self.assertEqual(
+                fb[-1],
+                ord("c"),
+            )
+
+            # Now shrink it and make sure we don't read past the end.
+            fb.truncate(5)
+            fb.write_changes()
+            handle.seek(0)
+            self.assertEqual(
+                handle.read(),
+                b"012a4",
+            )
+            self.assertEqual(
+                fb[:],
+                b"012a4",
+            )
+            self.assertEqual(
+                fb.clone()[1:4],
+                b"12a",
+            )
+
+    def test_mmap_fallback(self) -> None:
+        # Things that can't be mapped should silently fall back to reading.
+        fb = FileBytes(io.BytesIO(b"0123456789"), use_mmap=True)
+        self.assertEqual(
+            fb[2:6],
+            b"2345",
+        )
+
+        with tempfile.TemporaryFile() as handle:
+            fb = FileBytes(handle, use_mmap=True)
+            self.assertEqual(
+                len(fb),
+                0,
+            )
+            fb.append(b"abc")
+            fb.write_changes()
+            self.assertEqual(
+                fb[:],
+                b"abc",
+            )
+
+    def test_strided_reads(self) -> None:
+        b = bytearray((bytes(range(251)) * (FileBytes.IO_SIZE // 10))[:(FileBytes.IO_SIZE * 20 + 123)])
+        fb = FileBytes(io.BytesIO(bytes(b)))
+
+        # Modify some spots and grow the file so the overlay gets exercised.
+        for off in [0, 1, 5, FileBytes.IO_SIZE * 9 + 3, len(b) - 1]:
+            fb[off] = 0xFF - b[off]
+            b[off] = 0xFF - b[off]
+        fb.append(b"abcdefg")
+        b.extend(b"abcdefg")
+
+        for step in [2, 3, 4, 7, FileBytes.IO_SIZE - 1, FileBytes.IO_SIZE, FileBytes.IO_SIZE + 3]:
+            self.assertEqual(
+                fb[::step],
+                b[::step],
+            )
+            self.assertEqual(
+                fb[1::step],
+                b[1::step],
+            )
+            self.assertEqual(
+                fb[5:-3:step],
+                b[5:-3:step],
+            )
+            self.assertEqual(
+                fb[::-step],
+                b[::-step],
+            )
+            self.assertEqual(
+                fb[-2:3:-step],
+                b[-2:3:-step],
+            )
+
+    def test_cache_reads(self) -> None:
+        b = bytes(random.randint(0, 255) for _ in range(FileBytes.IO_SIZE * 4))
+        handle = CountingBytesIO(b)
+        fb = FileBytes(handle, cache_size=FileBytes.IO_SIZE * 2)
+
+        # Walking the file byte by byte should only load each block once.
+        handle.reads = 0
+        for i in range(0, FileBytes.IO_SIZE * 2, 7):
+            self.assertEqual(
+                fb[i],
+                b[i],
+            )
+        self.assertEqual(
+            handle.reads,
+            2,
+        )
+
+        # Reads that span cached blocks are served from the cache.
+        handle.reads = 0
+        self.assertEqual(
+            fb[(FileBytes.IO_SIZE - 5):(FileBytes.IO_SIZE + 5)],
+            b[(FileBytes.IO_SIZE - 5):(FileBytes.IO_SIZE + 5)],
+        )
+        self.assertEqual(
+            handle.reads,
+            0,
+        )
+
+        # Loading more blocks than fit evicts the least recently used.
+        self.assertEqual(
+            fb[FileBytes.IO_SIZE * 3],
+            b[FileBytes.IO_SIZE * 3],
+        )
+        self.assertEqual(
+            fb[FileBytes.IO_SIZE],
+            b[FileBytes.IO_SIZE],
+        )
+        handle.reads = 0
+        self.assertEqual(
+            fb[0],
+            b[0],
+        )
+        self.assertEqual(
+            handle.reads,
+            1,
+        )
+
+    def test_cache_invalidation(self) -> None:
+        fb = FileBytes(io.BytesIO(b"0123456789"), cache_size=FileBytes.IO_SIZE)
+        clone = fb.clone()
+        self.assertEqual(
+            fb[:],
+            b"0123456789",
+        )
+
+        # Truncating only changes our view, not the cached file contents.
+        fb.truncate(5)
+        self.assertEqual(
+            fb[:],
+            b"01234",
+        )
+        self.assertEqual(
+            clone[:],
+            b"0123456789",
+        )
+        fb[2] = 97
+        fb.write_changes()
+
+        # Writing back must throw away stale blocks, including for new clones.
+        self.assertEqual(
+            fb[:],
+            b"01a34",
+        )
+        self.assertEqual(
+            fb[2],
+            ord("a"),
+        )
+        fb[3] = 98
+        fb.write_changes()
+        self.assertEqual(
+            fb.clone()[:],
+            b"01ab4",
+        )
+
+    def test_write_new_file_streaming(self) -> None:
+        b = bytearray((bytes(range(251)) * (FileBytes.IO_SIZE // 10))[:(FileBytes.IO_SIZE * 20 + 123)])
+
+        with tempfile.TemporaryFile() as handle:
+            handle.write(b)
+            handle.flush()
+            fb = FileBytes(handle)
+
+            # Sprinkle changes across block boundaries, and shrink then grow the file.
+            for off in [0, FileBytes.IO_SIZE - 1, FileBytes.IO_SIZE * 8, FileBytes.IO_SIZE * 15 + 7]:
+                fb[off:(off + 3)] = b"xyz"
+                b[off:(off + 3)] = b"xyz"
+            fb.truncate(len(b) - 100)
+            del b[-100:]
+            fb.append(b"appended")
+            b.extend(b"appended")
+
+            # Write to both a real file and an in-memory file, where the new file
+            # already has longer content that should be discarded.
+            with tempfile.TemporaryFile() as new_file:
+                new_file.write(b"\xff" * (len(b) + 500))
+                fb.write_changes(new_file)
+                new_file.seek(0)
+                self.assertEqual(
+                    new_file.read(),
+                    b,
+                )
+
+            memory_file = io.BytesIO(b"\xff" * (len(b) + 500))
+            fb.write_changes(memory_file)
+            self.assertEqual(
+                memory_file.getvalue(),
+                b,
+            )
+
+            # The original must be untouched.
+            handle.seek(0)
+            self.assertEqual(
+                handle.read(),
+                (bytes(range(251)) * (FileBytes.IO_SIZE // 10))[:(FileBytes.IO_SIZE * 20 + 123)],
+            )
+
+    def test_readinto(self) -> None:
+        for use_mmap, cache_size in [(False, 0), (False, FileBytes.IO_SIZE), (True, 0)]:
+            with tempfile.TemporaryFile() as handle:
+                handle.write(b"0123456789")
+                handle.flush()
+                fb = FileBytes(handle, use_mmap=use_mmap, cache_size=cache_size)
+                fb[3:5] = b"ab"
+                fb.pad(12)
+                fb.append(b"cd")
+
+                # Fill a whole buffer.
+                buffer = bytearray(6)
+                self.assertEqual(
+                    fb.readinto(2, buffer),
+                    6,
+                )
+                self.assertEqual(
+                    buffer,
+                    b"2ab567",
+                )
+
+                # Reuse the buffer, reading over the end of the file into padding.
+                self.assertEqual(
+                    fb.readinto(8, buffer),
+                    6,
+                )
+                self.assertEqual(
+                    buffer,
+                    b"89\0\0cd",
+                )
+
+                # Reading near the end only partially fills the buffer.
+                self.assertEqual(
+                    fb.readinto(12, buffer),
+                    2,
+                )
+                self.assertEqual(
+                    buffer,
+                    b"cd\0\0cd",
+                )
+                self.assertEqual(
+                    fb.readinto(20, buffer),
+                    0,
+                )
+
+                # Memoryviews into part of a larger buffer work too.
+                buffer = bytearray(b"xxxxxxxx")
+                self.assertEqual(
+                    fb.readinto(0, memoryview(buffer)[2:6]),
+                    4,
+                )
+                self.assertEqual(
+                    buffer,
+                    b"xx012axx",
+                )
+
+                with self.assertRaises(IndexError):
+                    fb.readinto(-1, buffer)
+
+    def test_chunks(self) -> None:
+        b = bytearray((bytes(range(251)) * (FileBytes.IO_SIZE // 10))[:(FileBytes.IO_SIZE * 3 + 123)])
+        fb = FileBytes(io.BytesIO(bytes(b)))
+        fb[FileBytes.IO_SIZE:(FileBytes.IO_SIZE + 4)] = b"abcd"
+        b[FileBytes.IO_SIZE:(FileBytes.IO_SIZE + 4)] = b"abcd"
+        fb.append(b"efgh")
+        b.extend(b"efgh")
+
+        # Default chunk size, and reassembling the chunks gets back the whole file.
+        chunks = [(offset, bytes(chunk)) for offset, chunk in fb.chunks()]
+        self.assertEqual(
+            b"".join(chunk for _, chunk in chunks),
+            b,
+        )
+        self.assertEqual(
+            chunks[0][0],
+            0,
+        )
+
+        # Custom chunk sizes and bounds.
+        for size in [1, 7, FileBytes.IO_SIZE - 1, FileBytes.IO_SIZE]:
+            offsets = []
+            data = []
+            for offset, chunk in fb.chunks(size, start=5, end=len(b) - 2):
+                offsets.append(offset)
+                data.append(bytes(chunk))
+                self.assertLessEqual(
+                    len(chunk),
+                    size,
+                )
+            self.assertEqual(
+                offsets,
+                list(range(5, len(b) - 2, size)),
+            )
+            self.assertEqual(
+                b"".join(data),
+                b[5:-2],
+            )
+
+        self.assertEqual(
+            list(fb.chunks(start=10, end=5)),
+            [],
+        )
+        with self.assertRaises(ValueError):
+            list(fb.chunks(0))
+
+    def test_compressed_files(self) -> None:
+        data = bytes(random.getrandbits(8) for _ in range(FileBytes.IO_SIZE * 3 + 17))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = directory + "/data.gz"
+            with gzip.open(path, "wb") as fp:
+                fp.write(data)
+
+            # A compressed file reports the descriptor of the file underneath, which must
+            # not be read directly or we would see the compressed bytes instead.
+            with gzip.open(path, "rb") as handle:
+                fb = FileBytes(cast(BinaryIO, handle))
+                self.assertEqual(
+                    FileBytes(cast(BinaryIO, handle), use_mmap=True)[:],
+                    data,
+                )
+                self.assertEqual(
+                    len(fb),
+                    len(data),
+                )
+                self.assertEqual(
+                    fb[:16],
+                    data[:16],
+                )
+                self.assertEqual(
+                    fb[:],
+                    data,
+                )
+
+                fb[5:10] = b"abcde"
+                new_file = io.BytesIO()
+                fb.write_changes(new_file)
+                self.assertEqual(
+                    new_file.getvalue(),
+                    data[:5] + b"abcde" + data[10:],
+                )
+
+                # Copying untouched parts to a real file must not copy the compressed
+                # file underneath either.
+                with tempfile.TemporaryFile() as plain:
+                    fb.write_changes(plain)
+                    plain.seek(0)
+                    self.assertEqual(
+                        plain.read(),
+                        data[:5] + b"abcde" + data[10:],
+                    )
+
+            # Writing to a compressed file, which can neither be truncated nor have its
+            # underlying file written to directly, should also work.
+            with tempfile.TemporaryFile() as plain:
+                plain.write(data)
+                plain.flush()
+                fb = FileBytes(plain)
+                fb[5:10] = b"abcde"
+                with gzip.open(directory + "/new.gz", "wb") as output:
+                    fb.write_changes(cast(BinaryIO, output))
+                with gzip.open(directory + "/new.gz", "rb") as fp:
+                    self.assertEqual(
+                        fp.read(),
+                        data[:5] + b"abcde" + data[10:],
+                    )
+
+    def test_threaded_reads(self) -> None:
+        data = bytes(random.getrandbits(8) for _ in range(FileBytes.IO_SIZE * 6))
+
+        def verify(fb: FileBytes, seed: int) -> None:
+            rng = random.Random(seed)
+            for _ in range(200):
+                start = rng.randrange(0, len(data))
+                stop = min(start + rng.randrange(1, FileBytes.IO_SIZE * 2), len(data))
+                if fb[start:stop] != data[start:stop]:
+                    raise Exception(f"Read of {start}:{stop} returned the wrong data!")
+                if fb[start] != data[start]:
+                    raise Exception(f"Read of {start} returned the wrong data!")
+
+        with tempfile.TemporaryFile() as tmp:
+            tmp.write(data)
+            tmp.flush()
+
+            handles: List[BinaryIO] = [io.BytesIO(data), tmp]
+            for handle in handles:
+                for use_mmap, cache_size in [(False, 0), (False, FileBytes.IO_SIZE * 2), (True, 0)]:
+                    # Read the same instance and several clones sharing its handle from many
+                    # threads at once, making sure nobody sees anybody else's data.
+                    fb = FileBytes(handle, use_mmap=use_mmap, cache_size=cache_size)
+                    instances = [fb, fb.clone(), fb.clone()]
+                    with ThreadPoolExecutor(max_workers=8) as executor:
+                        results = [executor.submit(verify, instances[i % len(instances)], i) for i in range(16)]
+                        for result in results:
+                            result.result()
+
+    def test_insert_delete(self) -> None:
+        handle = io.BytesIO(b"0123456789")
+        fb = FileBytes(handle)
+        fb.insert(5, b"abc")
+        self.assertEqual(
+            fb[:],
+            b"01234abc56789",
+        )
+        fb.insert(0, b"<")
+        fb.insert(-1, b"!")
+        fb.insert(len(fb), b">")
+        self.assertEqual(
+            fb[:],
+            b"<01234abc5678!9>",
+        )
+        self.assertEqual(
+            fb[6:9],
+            b"abc",
+        )
+        self.assertEqual(
+            fb[9],
+            ord("5"),
+        )
+        with self.assertRaises(IndexError):
+            fb.insert(len(fb) + 1, b"x")
+
+        # Modifying data that has moved should modify the right spot.
+        clone = fb.clone()
+        fb[10] = ord("X")
+        self.assertEqual(
+            fb[:],
+            b"<01234abc5X78!9>",
+        )
+
+        # Deleting can span inserted and original data.
+        fb.delete(4, 8)
+        self.assertEqual(
+            fb[:],
+            b"<012c5X78!9>",
+        )
+        fb.delete(-3, None)
+        self.assertEqual(
+            fb[:],
+            b"<012c5X78",
+        )
+        fb.delete(5, 2)
+        self.assertEqual(
+            fb[:],
+            b"<012c5X78",
+        )
+
+        # The clone shouldn't have seen any of that.
+        self.assertEqual(
+            clone[:],
+            b"<01234abc5678!9>",
+        )
+
+        # Deleting the inserted data leaves us with the original file again, which can
+        # be written back in place.
+        clone.delete(0, 1)
+        clone.delete(5, 8)
+        clone.delete(-3, -2)
+        clone.delete(-1, None)
+        self.assertEqual(
+            clone[:],
+            b"0123456789",
+        )
+        clone[0] = ord("A")
+        clone.write_changes()
+        self.assertEqual(
+            handle.getvalue(),
+            b"A123456789",
+        )
+
+    def test_insert_delete_write(self) -> None:
+        b = bytes(random.getrandbits(8) for _ in range(FileBytes.IO_SIZE * 3))
+        expected = bytearray(b)
+        with tempfile.TemporaryFile() as handle:
+            handle.write(b)
+            handle.flush()
+            fb = FileBytes(handle)
+
+            # Insert a large cave in the middle, and remove something near the start.
+            fb.insert(FileBytes.IO_SIZE, b"\xAA" * FileBytes.IO_SIZE)
+            expected[FileBytes.IO_SIZE:FileBytes.IO_SIZE] = b"\xAA" * FileBytes.IO_SIZE
+            fb.delete(10, 20)
+            del expected[10:20]
+            fb.pad(len(expected) + 5)
+            expected.extend(b"\0" * 5)
+            self.assertEqual(
+                fb[:],
+                expected,
+            )
+
+            newfile = io.BytesIO()
+            fb.write_changes(newfile)
+            self.assertEqual(
+                newfile.getvalue(),
+                expected,
+            )
+
+            # Writing back in place has to move data around.
+            fb.write_changes()
+            handle.seek(0)
+            self.assertEqual(
+                handle.read(),
+                expected,
+            )
+            self.assertEqual(
+                fb[:],
+                expected,
+            )
+
+            # Now shrink it back down in place.
+            fb.delete(0, FileBytes.IO_SIZE)
+            del expected[0:FileBytes.IO_SIZE]
+            fb.write_changes()
+            handle.seek(0)
+            self.assertEqual(
+                handle.read(),
+                expected,
+            )
+
+    def test_append_truncate_write(self) -> None:
+        handle = io.BytesIO(b"abcdef")
+        fb = FileBytes(handle)
+        fb.append(b"0123456789")
+        fb.write_changes()
+        fb.truncate(12)
+        fb.write_changes()
+        self.assertEqual(
+            handle.getvalue(),
+            b"abcdef012345",
+        )
+
+    def test_undo_redo(self) -> None:
+        handle = io.BytesIO(b"0123456789")
+        fb = FileBytes(handle, journal=True)
+        self.assertFalse(fb.undo())
+        self.assertFalse(fb.redo())
+
+        fb[0] = ord("a")
+        fb[2:4] = b"bc"
+        fb.append(b"def")
+        fb.insert(5, b"XY")
+        fb.delete(0, 2)
+        fb.truncate(8)
+        fb.pad(10, 0x21)
+        self.assertEqual(
+            fb[:],
+            b"bc4XY567!!",
+        )
+
+        history = [
+            b"bc4XY567",
+            b"bc4XY56789def",
+            b"a1bc4XY56789def",
+            b"a1bc456789def",
+            b"a1bc456789",
+            b"a123456789",
+            b"0123456789",
+        ]
+        for expected in history:
+            self.assertTrue(fb.undo())
+            self.assertEqual(
+                fb[:],
+                expected,
+            )
+        self.assertFalse(fb.undo())
+        for expected in reversed([b"bc4XY567!!"] + history[:-1]):
+            self.assertTrue(fb.redo())
+            self.assertEqual(
+                fb[:],
+                expected,
+            )
+        self.assertFalse(fb.redo())
+
+        # Making a new edit after undoing throws away the edits that were undone.
+        fb.undo()
+        fb.undo()
+        fb[0] = ord("z")
+        self.assertFalse(fb.redo())
+        self.assertEqual(
+            fb[:],
+            b"zc4XY56789def",
+        )
+
+        # Undoing everything gets us back to the original file, which can be written
+        # back in place without any trouble.
+        while fb.undo():
+            pass
+        fb[9] = ord("!")
+        fb.write_changes()
+        self.assertEqual(
+            handle.getvalue(),
+            b"012345678!",
+        )
+        self.assertFalse(fb.undo())
+
+        # Without the journal turned on, none of this is available.
+        with self.assertRaises(Exception):
+            FileBytes(io.BytesIO(b"")).undo()
+
+    def test_snapshots(self) -> None:
+        fb = FileBytes(io.BytesIO(b"0123456789"), journal=True)
+        fb.snapshot("original")
+        fb[0:2] = b"ab"
+        fb.snapshot("first")
+        fb.insert(2, b"cd")
+        fb.snapshot("second")
+
+        clone = fb.clone()
+        clone[0] = ord("Z")
+
+        fb.restore("original")
+        self.assertEqual(
+            fb[:],
+            b"0123456789",
+        )
+        fb.restore("second")
+        self.assertEqual(
+            fb[:],
+            b"abcd23456789",
+        )
+        fb.restore("first")
+        self.assertEqual(
+            fb[:],
+            b"ab23456789",
+        )
+
+        # The clone keeps its own journal.
+        self.assertEqual(
+            clone[:],
+            b"Zbcd23456789",
+        )
+        self.assertTrue(clone.undo())
+        self.assertFalse(clone.undo())
+        self.assertEqual(
+            clone[:],
+            b"abcd23456789",
+        )
+
+        # Editing from an earlier snapshot throws away any later ones.
+        fb.delete(0, 1)
+        with self.assertRaises(ValueError):
+            fb.restore("second")
+        fb.restore("first")
+        self.assertEqual(
+            fb[:],
+            b"ab23456789",
+        )
+
+    def test_random_undo_redo(self) -> None:
+        for _ in range(10):
+            b = bytes(random.randint(0, 255) for _ in range(random.randint(1, 300)))
+            history = [b]
+            fb = FileBytes(io.BytesIO(b), journal=True)
+
+            for _ in range(40):
+                expected = bytearray(history[-1])
+                action = random.randint(0, 5)
+                if action == 0:
+                    data = bytes(random.randint(0, 255) for _ in range(random.randint(1, 20)))
+                    fb.append(data)
+                    expected.extend(data)
+                elif action == 1 and expected:
+                    size = random.randint(0, len(expected) - 1)
+                    fb.truncate(size)
+                    del expected[size:]
+                elif action == 2:
+                    offset = random.randint(0, len(expected))
+                    data = bytes(random.randint(0, 255) for _ in range(random.randint(1, 20)))
+                    fb.insert(offset, data)
+                    expected[offset:offset] = data
+                elif action == 3 and expected:
+                    start = random.randint(0, len(expected) - 1)
+                    end = random.randint(start + 1, len(expected))
+                    fb.delete(start, end)
+                    del expected[start:end]
+                elif expected:
+                    start = random.randint(0, len(expected) - 1)
+                    end = random.randint(start + 1, len(expected))
+                    data = bytes(random.randint(0, 255) for _ in range(end - start))
+                    fb[start:end] = data
+                    expected[start:end] = data
+                else:
+                    continue
+                history.append(bytes(expected))
+
+            # Walk all the way back and forth again, checking every step.
+            for state in reversed(history[:-1]):
+                self.assertTrue(fb.undo())
+                self.assertEqual(
+                    fb[:],
+                    state,
+                )
+            for state in history[1:]:
+                self.assertTrue(fb.redo())
+                self.assertEqual(
+                    fb[:],
+                    state,
+                )
+
+    def test_stats(self) -> None:
+        self.assertIsNone(FileBytes(io.BytesIO(b"")).stats)
+
+        fb = FileBytes(io.BytesIO(bytes(range(256)) * 4), stats=True, cache_size=FileBytes.IO_SIZE)
+        stats = fb.stats
+        if stats is None:
+            raise Exception("Stats were not enabled!")
+        self.assertEqual(
+            stats.dump(),
+            {
+                "seeks": 0,
+                "reads": 0,
+                "bytes_read": 0,
+                "cache_hits": 0,
+                "overlay_hits": 0,
+                "flattens": 0,
+                "slow_slices": 0,
+                "bytes_written": 0,
+            },
+        )
+
+        # Reading a byte at a time only goes to the file once with the cache on.
+        for i in range(10):
+            fb[i]
+        self.assertEqual(
+            (stats.seeks, stats.reads, stats.bytes_read, stats.cache_hits),
+            (1, 1, 1024, 9),
+        )
+
+        # Modified data comes from the overlay, and strided reads take the slow path.
+        fb[5:7] = b"ab"
+        fb[0:10:2]
+        fb[5]
+        self.assertEqual(
+            (stats.overlay_hits, stats.slow_slices),
+            (2, 1),
+        )
+
+        # Clones share the same stats, and rearranging data after cloning means the
+        # shared changes have to be flattened.
+        clone = fb.clone()
+        self.assertIs(
+            clone.stats,
+            stats,
+        )
+        clone.insert(0, b"xyz")
+        self.assertEqual(
+            stats.flattens,
+            1,
+        )
+
+        stats.reset()
+        self.assertEqual(
+            stats.reads,
+            0,
+        )
+        fb.write_changes()
+        self.assertEqual(
+            (stats.seeks, stats.bytes_written),
+            (1, 2),
+        )
+        fb.write_changes(io.BytesIO())
+        self.assertEqual(
+            stats.bytes_written,
+            1026,
+        )
+        self.assertIn(
+            "bytes_written=1026",
+            repr(stats),
+        )
+
+        # Writing back after an insert goes through a temporary file, but only what
+        # actually lands in our own file should count.
+        clone = FileBytes(io.BytesIO(bytes(1000)), stats=True)
+        clonestats = clone.stats
+        if clonestats is None:
+            raise Exception("Stats were not enabled!")
+        clone.insert(10, b"abc")
+        clone.write_changes()
+        self.assertEqual(
+            clonestats.bytes_written,
+            1003,
+        )
+
+    def test_compare(self) -> None:
+        b = bytes(random.getrandbits(8) for _ in range(FileBytes.IO_SIZE * 10))
+        fb = FileBytes(io.BytesIO(b))
+        other = FileBytes(io.BytesIO(b))
+
+        self.assertTrue(fb == b)
+        self.assertTrue(fb == bytearray(b))
+        self.assertTrue(fb == other)
+        self.assertFalse(fb != other)
+        self.assertFalse(fb == b[:-1])
+        self.assertFalse(fb == "not bytes")
+        with self.assertRaises(TypeError):
+            hash(fb)
+
+        self.assertIsNone(fb.compare(b))
+        other[FileBytes.IO_SIZE * 9 + 5] = b[FileBytes.IO_SIZE * 9 + 5] ^ 0xFF
+        self.assertEqual(
+            fb.compare(other),
+            FileBytes.IO_SIZE * 9 + 5,
+        )
+        self.assertIsNone(fb.compare(other, end=FileBytes.IO_SIZE * 9 + 5))
+        self.assertEqual(
+            fb.compare(other, FileBytes.IO_SIZE * 9),
+            FileBytes.IO_SIZE * 9 + 5,
+        )
+        self.assertIsNone(fb.compare(other, FileBytes.IO_SIZE * 9 + 6))
+
+        # Lengths that differ count as a difference at the end of the shorter one.
+        self.assertEqual(
+            fb.compare(b + b"x"),
+            len(b),
+        )
+        self.assertEqual(
+            fb.compare(b[:100], 200),
+            200,
+        )
+        self.assertIsNone(fb.compare(b[:100], 200, 100))
+
+    def test_compare_clones(self) -> None:
+        b = bytes(random.getrandbits(8) for _ in range(FileBytes.IO_SIZE * 10))
+        fb = FileBytes(io.BytesIO(b), stats=True)
+        stats = fb.stats
+        if stats is None:
+            raise Exception("Stats were not enabled!")
+
+        fb[100:200] = b"z" * 100
+        clone = fb.clone()
+        clone[150:250] = b"z" * 100
+        fb[200:250] = b"z" * 50
+
+        # Clones of the same file only need to compare what they changed.
+        stats.reset()
+        self.assertTrue(fb == clone)
+        self.assertEqual(
+            stats.bytes_read,
+            0,
+        )
+
+        clone[FileBytes.IO_SIZE * 5] = b[FileBytes.IO_SIZE * 5] ^ 0xFF
+        self.assertEqual(
+            fb.compare(clone),
+            FileBytes.IO_SIZE * 5,
+        )
+        self.assertEqual(
+            stats.bytes_read,
+            1,
+        )
+        clone[FileBytes.IO_SIZE * 5] = b[FileBytes.IO_SIZE * 5]
+
+        # Moving data around means that data has to actually be compared.
+        clone.insert(1000, b"abc")
+        self.assertEqual(
+            fb.compare(clone),
+            1000,
+        )
+        clone.delete(1000, 1003)
+        self.assertTrue(fb == clone)
+        fb.insert(2000, bytes([b[2000] ^ 0xFF]))
+        fb.delete(2001, 2002)
+        self.assertEqual(
+            fb.compare(clone),
+            2000,
+        )
+        clone.insert(2000, bytes([b[2000] ^ 0xFF]))
+        clone.delete(2001, 2002)
+        self.assertTrue(fb == clone)
+        fb.append(b"!")
+        self.assertEqual(
+            clone.compare(fb),
+            len(b),
+        )
+
+    def test_compare_random(self) -> None:
+        for _ in range(25):
+            b = bytes(random.randint(0, 3) for _ in range(random.randint(1, 300)))
+            fb = FileBytes(io.BytesIO(b))
+            clone = fb.clone()
+            mine = bytearray(b)
+            theirs = bytearray(b)
+            for _ in range(10):
+                side, expected = random.choice([(fb, mine), (clone, theirs)])
+                action = random.randint(0, 2)
+                if action == 0:
+                    offset = random.randint(0, len(expected))
+                    data = bytes(random.randint(0, 3) for _ in range(random.randint(1, 5)))
+                    side.insert(offset, data)
+                    expected[offset:offset] = data
+                elif action == 1 and expected:
+                    start = random.randint(0, len(expected) - 1)
+                    end = random.randint(start + 1, min(start + 5, len(expected)))
+                    side.delete(start, end)
+                    del expected[start:end]
+                elif expected:
+                    start = random.randint(0, len(expected) - 1)
+                    end = random.randint(start + 1, min(start + 5, len(expected)))
+                    data = bytes(random.randint(0, 3) for _ in range(end - start))
+                    side[start:end] = data
+                    expected[start:end] = data
+
+                first: Optional[int] = None
+                for offset in range(max(len(mine), len(theirs))):
+                    if offset >= len(mine) or offset >= len(theirs) or mine[offset] != theirs[offset]:
+                        first = offset
+                        break
+                self.assertEqual(
+                    fb.compare(clone),
+                    first,
+                )
+                self.assertEqual(
+                    fb.compare(bytes(theirs)),
+                    first,
+                )
+                self.assertEqual(
+                    fb == clone,
+                    mine == theirs,
+                )
+
+    def test_hashes(self) -> None:
+        empty = FileBytes(io.BytesIO(b""))
+        self.assertEqual(
+            (empty.crc32(), empty.sha1(), empty.md5(), empty.fingerprint()),
+            (0, hashlib.sha1(b"").hexdigest(), hashlib.md5(b"").hexdigest(), hashlib.sha1(b"").hexdigest()),
+        )
+
+        b = bytes(random.getrandbits(8) for _ in range(FileBytes.HASH_SIZE * 5 + 123))
+        expected = bytearray(b)
+        handle = io.BytesIO(b)
+        fb = FileBytes(handle, stats=True)
+        stats = fb.stats
+        if stats is None:
+            raise Exception("Stats were not enabled!")
+
+        def verify() -> None:
+            self.assertEqual(
+                fb.crc32(),
+                zlib.crc32(expected),
+            )
+            self.assertEqual(
+                fb.sha1(),
+                hashlib.sha1(expected).hexdigest(),
+            )
+            self.assertEqual(
+                fb.md5(),
+                hashlib.md5(expected).hexdigest(),
+            )
+
+            level = [
+                hashlib.sha1(expected[start:(start + FileBytes.HASH_SIZE)]).digest()
+                for start in range(0, len(expected), FileBytes.HASH_SIZE)
+            ]
+            while len(level) > 1:
+                level = [
+                    hashlib.sha1(level[index] + level[index + 1]).digest() if index + 1 < len(level) else level[index]
+                    for index in range(0, len(level), 2)
+                ]
+            self.assertEqual(
+                fb.fingerprint(),
+                level[0].hex(),
+            )
+
+        verify()
+
+        # After a small change, only the changed block needs to be read again.
+        fb[FileBytes.HASH_SIZE * 2 + 5] = 0x55
+        expected[FileBytes.HASH_SIZE * 2 + 5] = 0x55
+        stats.reset()
+        fb.crc32()
+        fb.fingerprint()
+        self.assertEqual(
+            stats.bytes_read,
+            FileBytes.HASH_SIZE * 2,
+        )
+        verify()
+
+        for _ in range(10):
+            action = random.randint(0, 3)
+            if action == 0:
+                offset = random.randint(0, len(expected))
+                data = bytes(random.getrandbits(8) for _ in range(random.randint(1, 100)))
+                fb.insert(offset, data)
+                expected[offset:offset] = data
+            elif action == 1:
+                start = random.randint(0, len(expected) - 1000)
+                fb.delete(start, start + 100)
+                del expected[start:(start + 100)]
+            elif action == 2:
+                fb.append(b"\xFF" * 100)
+                expected.extend(b"\xFF" * 100)
+            else:
+                start = random.randint(0, len(expected) - 100)
+                fb[start:(start + 100)] = b"\0" * 100
+                expected[start:(start + 100)] = b"\0" * 100
+            verify()
+
+        # Writing back changes the file, so nothing remembered can be trusted anymore.
+        fb.write_changes()
+        verify()
+
+    def test_hash_cache_bounded(self) -> None:
+        b = bytes(random.getrandbits(8) for _ in range(FileBytes.HASH_SIZE * 64))
+        expected = bytearray(b)
+        fb = FileBytes(io.BytesIO(b), stats=True)
+        stats = fb.stats
+        if stats is None:
+            raise Exception("Stats were not enabled!")
+
+        # Every insert shifts all of the blocks of the file onto new cache keys, which
+        # shouldn't leave old entries piling up in the shared hash caches.
+        source = getattr(fb, "_FileBytes__source")
+        for _ in range(20):
+            fb.insert(0, b"x")
+            expected[0:0] = b"x"
+            self.assertEqual(
+                fb.crc32(),
+                zlib.crc32(expected),
+            )
+            self.assertEqual(
+                fb.fingerprint(),
+                FileBytes(io.BytesIO(bytes(expected))).fingerprint(),
+            )
+            self.assertLessEqual(len(source.crcs), 65 * 2)
+            self.assertLessEqual(len(source.digests), 65 * 2)
+
+        # Hashing again without any changes should still be served from the cache, except
+        # for the first block which holds the inserted data.
+        stats.reset()
+        self.assertEqual(
+            fb.crc32(),
+            zlib.crc32(expected),
+        )
+        self.assertLess(stats.bytes_read, FileBytes.HASH_SIZE)
+
+    def test_undo_log(self) -> None:
+        class CrashingIO(io.BytesIO):
+            def __init__(self, data: bytes, writes: int) -> None:
+                super().__init__(data)
+                self.writes = writes
+
+            def write(self, data: bytes) -> int:  # type: ignore
+                if self.writes <= 0:
+                    raise OSError("Simulated crash!")
+                self.writes -= 1
+                return super().write(data)
+
+        original = bytes(random.randrange(256) for _ in range(FileBytes.IO_SIZE * 9 + 17))
+
+        def modify(fb: FileBytes, kind: int) -> None:
+            fb[5:10] = b"abcde"
+            fb[FileBytes.IO_SIZE:(FileBytes.IO_SIZE + 3)] = b"xyz"
+            if kind == 1:
+                fb.truncate(FileBytes.IO_SIZE * 2)
+            elif kind == 2:
+                fb.append(b"appended")
+            elif kind == 3:
+                fb.insert(100, b"inserted")
+                fb.delete(5000, 6000)
+
+        with tempfile.TemporaryDirectory() as directory:
+            log = directory + "/undo.log"
+
+            for kind in range(4):
+                # A write that completes should look exactly like one without a log, and
+                # should leave no log behind to recover from.
+                handle = io.BytesIO(original)
+                fb = FileBytes(handle)
+                modify(fb, kind)
+                expected = fb[:]
+                fb.write_changes(undo_log=log, fsync=True)
+                self.assertEqual(
+                    handle.getvalue(),
+                    expected,
+                )
+                self.assertFalse(FileBytes.recover(handle, log))
+                self.assertEqual(
+                    handle.getvalue(),
+                    expected,
+                )
+
+                # A write that crashes part of the way through should be rolled back.
+                for writes in range(2):
+                    handle = CrashingIO(original, writes)
+                    fb = FileBytes(handle)
+                    modify(fb, kind)
+                    with self.assertRaises(OSError):
+                        fb.write_changes(undo_log=log)
+                    handle.writes = 1000000
+                    self.assertTrue(FileBytes.recover(handle, log))
+                    self.assertEqual(
+                        handle.getvalue(),
+                        original,
+                    )
+
+            # A log that was never finished means the file was never touched, so there
+            # is nothing to undo, but the log should still be cleaned up.
+            handle = io.BytesIO(original)
+            fb = FileBytes(handle)
+            modify(fb, 0)
+            fb.write_changes(undo_log=log)
+            with open(log, "wb") as fp:
+                fp.write(b"FBUNDO01")
+            self.assertFalse(FileBytes.recover(handle, log))
+            self.assertFalse(FileBytes.recover(handle, log))
+
+        # Logs only make sense for writing in place.
+        fb = FileBytes(io.BytesIO(original))
+        with self.assertRaises(ValueError):
+            fb.write_changes(io.BytesIO(), undo_log="undo.log")
+
+    def test_fsync(self) -> None:
+        with tempfile.TemporaryFile() as handle:
+            handle.write(b"0123456789")
+            handle.flush()
+            fb = FileBytes(handle)
+            fb[3:6] = b"abc"
+            fb.append(b"tail")
+
+            with tempfile.TemporaryFile() as other:
+                fb.write_changes(other, fsync=True)
+                other.seek(0)
+                self.assertEqual(
+                    other.read(),
+                    b"012abc6789tail",
+                )
+
+            fb.write_changes(fsync=True)
+            handle.seek(0)
+            self.assertEqual(
+                handle.read(),
+                b"012abc6789tail",
+            )
+
+    def test_buffers(self) -> None:
+        original = bytes(random.randrange(256) for _ in range(FileBytes.IO_SIZE * 2 + 17))
+
+        # Every kind of buffer should read exactly the same as a file handle would.
+        buffers: List[Union[bytes, bytearray, memoryview]] = [original, bytearray(original), memoryview(original), memoryview(bytearray(original))]
+        for buffer in buffers:
+            fb = FileBytes(buffer)
+            self.assertEqual(
+                len(fb),
+                len(original),
+            )
+            self.assertEqual(
+                fb[:],
+                original,
+            )
+            self.assertEqual(
+                fb[100],
+                original[100],
+            )
+            self.assertEqual(
+                fb[500:10:-3],
+                original[500:10:-3],
+            )
+            self.assertEqual(
+                fb.search(original[1000:1010]),
+                original.find(original[1000:1010]),
+            )
+
+            # Modifications and clones behave the same too.
+            fb[5:10] = b"abcde"
+            clone = fb.clone()
+            clone.insert(0, b"xyz")
+            self.assertEqual(
+                fb[:],
+                original[:5] + b"abcde" + original[10:],
+            )
+            self.assertEqual(
+                clone[:],
+                b"xyz" + original[:5] + b"abcde" + original[10:],
+            )
+
+            # And so does writing to a new file.
+            new_file = io.BytesIO()
+            clone.write_changes(new_file)
+            self.assertEqual(
+                new_file.getvalue(),
+                clone[:],
+            )
+
+        # A bytearray can be written back to in place, including changing its size.
+        buffer = bytearray(original)
+        fb = FileBytes(buffer)
+        fb[5:10] = b"abcde"
+        fb.append(b"appended")
+        fb.write_changes()
+        self.assertEqual(
+            buffer,
+            original[:5] + b"abcde" + original[10:] + b"appended",
+        )
+        fb.delete(0, 5)
+        fb.truncate(20)
+        fb.write_changes()
+        self.assertEqual(
+            buffer,
+            b"abcde" + original[10:25],
+        )
+        self.assertEqual(
+            fb[:],
+            b"abcde" + original[10:25],
+        )
+
+        # A writable memoryview can be written back to, as long as its size doesn't change.
+        view = memoryview(bytearray(original))
+        fb = FileBytes(view)
+        fb[0:3] = b"xyz"
+        fb.write_changes()
+        self.assertEqual(
+            view.tobytes(),
+            b"xyz" + original[3:],
+        )
+        fb.truncate(10)
+        with self.assertRaises(Exception):
+            fb.write_changes()
+        self.assertEqual(
+            view.tobytes(),
+            b"xyz" + original[3:],
+        )
+
+        # Changes made directly to the buffer show up in reads and hashes, even when those
+        # were already hashed before the change, and the buffer can still be resized.
+        buffer = bytearray(original)
+        fb = FileBytes(buffer)
+        fb.crc32()
+        fb.fingerprint()
+        buffer[5] = (buffer[5] + 1) % 256
+        self.assertEqual(
+            fb[5],
+            buffer[5],
+        )
+        self.assertEqual(
+            fb.crc32(),
+            zlib.crc32(buffer),
+        )
+        self.assertEqual(
+            fb.fingerprint(),
+            FileBytes(io.BytesIO(bytes(buffer))).fingerprint(),
+        )
+        buffer.extend(b"more")
+        buffer[-4:] = b""
+        self.assertEqual(
+            fb[:],
+            bytes(buffer),
+        )
+
+        # Bytes can't be written back to at all.
+        fb = FileBytes(original)
+        fb[0:3] = b"xyz"
+        with self.assertRaises(Exception):
+            fb.write_changes()
+        self.assertEqual(
+            fb[:],
+            b"xyz" + original[3:],
+        )
@@ -0,0 +1,112 @@
+import io
+import random
+import unittest
+from typing import List, Optional
+
+from arcadeutils import FileBytes, MaskedSearch
+
+
+class TestMaskedSearch(unittest.TestCase):
+
+    def __naive(self, data: bytes, pattern: List[Optional[int]]) -> List[int]:
+        return [
+            i for i in range(len(data) - len(pattern) + 1)
+            if all(p is None or p == data[i + j] for j, p in enumerate(pattern))
+        ]
+
+    def test_search_basic(self) -> None:
+        searcher = MaskedSearch("AA * CC DD")
+        self.assertEqual(
+            len(searcher),
+            4,
+        )
+        self.assertEqual(
+            searcher.search(b"\xAA\x00\xCC\xCC\xAA\x11\xCC\xDD"),
+            4,
+        )
+        self.assertEqual(
+            searcher.search(b"\xAA\x00\xCC\xCC\xAA\x11\xCC\xDE"),
+            None,
+        )
+
+        # Lists with None for wildcards work too.
+        searcher = MaskedSearch([0xAA, None, 0xCC, 0xDD])
+        self.assertEqual(
+            searcher.search(b"\xAA\x00\xCC\xCC\xAA\x11\xCC\xDD"),
+            4,
+        )
+
+    def test_search_filebytes(self) -> None:
+        searcher = MaskedSearch("30 * 32 * * 35")
+        fb = FileBytes(io.BytesIO((b"\0" * 54321) + (b"0123456789") + (b"\0" * 54321)))
+        self.assertEqual(
+            searcher.search(fb),
+            54321,
+        )
+
+        # Make sure that modifications are honored, including in wildcards.
+        fb[54322] = ord("a")
+        self.assertEqual(
+            searcher.search(fb),
+            54321,
+        )
+        fb[54323] = ord("a")
+        self.assertEqual(
+            searcher.search(fb),
+            None,
+        )
+
+    def test_search_all(self) -> None:
+        searcher = MaskedSearch("61 * 61")
+        data = b"aaaaxa.a"
+        self.assertEqual(
+            list(searcher.search_all(data)),
+            [0, 3],
+        )
+        self.assertEqual(
+            list(searcher.search_all(data, overlapping=True)),
+            [0, 1, 3, 5],
+        )
+        self.assertEqual(
+            list(searcher.search_all(data, overlapping=True, alignment=2)),
+            [0],
+        )
+        self.assertEqual(
+            list(searcher.search_all(data, start=1, end=6)),
+            [1],
+        )
+
+        # A pattern of only wildcards matches everywhere it fits.
+        self.assertEqual(
+            list(MaskedSearch("* *").search_all(b"abcd", overlapping=True)),
+            [0, 1, 2],
+        )
+
+    def test_search_window_boundary(self) -> None:
+        searcher = MaskedSearch("31 32 * 34 35")
+        location = MaskedSearch.CHUNK_SIZE - 3
+        fb = FileBytes(io.BytesIO((b"\0" * location) + (b"12345") + (b"\0" * 100)))
+        self.assertEqual(
+            searcher.search(fb),
+            location,
+        )
+
+    def test_search_random(self) -> None:
+        for _ in range(25):
+            data = bytes(random.choice(b"ab") for _ in range(random.randint(1, 500)))
+            pattern = [
+                random.choice([ord("a"), ord("b"), None])
+                for _ in range(random.randint(1, 6))
+            ]
+            self.assertEqual(
+                list(MaskedSearch(pattern).search_all(data, overlapping=True)),
+                self.__naive(data, pattern),
+            )
+
+    def test_invalid_pattern(self) -> None:
+        with self.assertRaises(ValueError):
+            MaskedSearch("")
+        with self.assertRaises(ValueError):
+            MaskedSearch("AA 1FF")
+        with self.assertRaises(ValueError):
+            MaskedSearch("AA ZZ")
@@ -0,0 +1,107 @@
+import io
+import random
+import unittest
+from typing import Dict, List
+
+from arcadeutils import FileBytes, MultiSearch
+
+
+class TestMultiSearch(unittest.TestCase):
+
+    def __naive(self, data: bytes, patterns: List[bytes]) -> Dict[bytes, List[int]]:
+        results: Dict[bytes, List[int]] = {}
+        for pattern in patterns:
+            results[pattern] = [
+                i for i in range(len(data) - len(pattern) + 1)
+                if data[i:(i + len(pattern))] == pattern
+            ]
+        return results
+
+    def test_search_basic(self) -> None:
+        searcher = MultiSearch([b"he", b"she", b"his", b"hers"])
+        self.assertEqual(
+            searcher.search(b"ahishers"),
+            {
+                b"he": [4],
+                b"she": [3],
+                b"his": [1],
+                b"hers": [4],
+            },
+        )
+
+    def test_search_filebytes(self) -> None:
+        searcher = MultiSearch([b"0123", b"2345", b"abc"])
+        fb = FileBytes(io.BytesIO((b"\0" * 54321) + (b"0123456789") + (b"\0" * 54321)))
+        self.assertEqual(
+            searcher.search(fb),
+            {
+                b"0123": [54321],
+                b"2345": [54323],
+                b"abc": [],
+            },
+        )
+
+        # Make sure that modifications are honored and the searcher is reusable.
+        fb[54323] = ord("a")
+        fb.append(b"abc")
+        self.assertEqual(
+            searcher.search(fb),
+            {
+                b"0123": [],
+                b"2345": [],
+                b"abc": [len(fb) - 3],
+            },
+        )
+
+    def test_search_bounds(self) -> None:
+        searcher = MultiSearch([b"aa", b"b"])
+        data = b"aabaab"
+        self.assertEqual(
+            searcher.search(data, start=1),
+            {
+                b"aa": [3],
+                b"b": [2, 5],
+            },
+        )
+        self.assertEqual(
+            searcher.search(data, end=4),
+            {
+                b"aa": [0],
+                b"b": [2],
+            },
+        )
+        self.assertEqual(
+            searcher.search(data, start=3, end=5),
+            {
+                b"aa": [3],
+                b"b": [],
+            },
+        )
+
+    def test_search_chunk_boundary(self) -> None:
+        searcher = MultiSearch([b"12345", b"345"])
+        location = MultiSearch.CHUNK_SIZE - 3
+        fb = FileBytes(io.BytesIO((b"\0" * location) + (b"12345") + (b"\0" * 100)))
+        self.assertEqual(
+            searcher.search(fb),
+            {
+                b"12345": [location],
+                b"345": [location + 2],
+            },
+        )
+
+    def test_search_random(self) -> None:
+        for _ in range(25):
+            data = bytes(random.choice(b"abc") for _ in range(random.randint(1, 500)))
+            patterns = [
+                bytes(random.choice(b"abc") for _ in range(random.randint(1, 5)))
+                for _ in range(random.randint(1, 10))
+            ]
+            self.assertEqual(
+                MultiSearch(patterns).search(data),
+                self.__naive(data, patterns),
+            )
+
+    def test_empty_pattern(self) -> None:
+        with self.assertRaises(ValueError):
+            MultiSearch([b"abc", b""])